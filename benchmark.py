@@ -0,0 +1,316 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+import js_audioops
+
+s_script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "js-audioops.py")
+
+@click.group
+def mycommands():
+    pass
+
+l_characters = ["cal", "greez", "bd1", "merrin", "cere", "bode", "rayvis", "dagan", "zna4", "cordova"]
+
+def write_bnk(fileName, l_wems, l_sections):
+    """Write a bnk with a BKHD header, a DIDX/DATA pair for l_wems [(id, payload)] and the given trailing sections."""
+    b_didx = bytearray()
+    b_data = bytearray()
+    for wemId, payload in l_wems:
+        if len(b_data) % 16 != 0:
+            b_data += bytes(16 - len(b_data) % 16)
+        b_didx += struct.pack("<III", wemId, len(b_data), len(payload))
+        b_data += payload
+    with open(fileName, 'wb') as f:
+        b_bkhd = struct.pack("<II", 0x8C, random.getrandbits(32)) + bytes(16)
+        f.write(b"BKHD" + struct.pack("<I", len(b_bkhd)) + b_bkhd)
+        if len(l_wems) > 0:
+            f.write(b"DIDX" + struct.pack("<I", len(b_didx)) + b_didx)
+            f.write(b"DATA" + struct.pack("<I", len(b_data)) + b_data)
+        for secName, b_section in l_sections:
+            f.write(secName.encode() + struct.pack("<I", len(b_section)) + b_section)
+
+def write_xml(fileName, bnk_short_name, l_events, l_bank_files):
+    """Write a Wwise style SoundbanksInfo xml. l_events is [(event name, streamed files, memory files)] with files as (id, short name, path)."""
+    def files_xml(tag, l_files):
+        if len(l_files) == 0:
+            return ""
+        s_files = "".join(f'<File Id="{file_id}" Language="SFX"><ShortName>{short_name}.wav</ShortName><Path>SFX/{path}.wem</Path></File>' for file_id, short_name, path in l_files)
+        return f"<{tag}>{s_files}</{tag}>"
+    l_xml = ['<?xml version="1.0" encoding="utf-8"?>\n<SoundBanksInfo Platform="Windows"><SoundBanks>']
+    l_xml.append(f'<SoundBank Id="{random.getrandbits(32)}" Language="SFX"><ShortName>{bnk_short_name}</ShortName><Path>{bnk_short_name}.bnk</Path><IncludedEvents>')
+    for event_name, l_streamed, l_memory in l_events:
+        l_xml.append(f'<Event Id="{random.getrandbits(32)}" Name="{event_name}">')
+        l_xml.append(files_xml("ReferencedStreamedFiles", l_streamed))
+        l_xml.append(files_xml("IncludedMemoryFiles", l_memory))
+        l_xml.append("</Event>")
+    l_xml.append("</IncludedEvents>")
+    l_xml.append(files_xml("IncludedMemoryFiles", l_bank_files))
+    l_xml.append("</SoundBank></SoundBanks></SoundBanksInfo>\n")
+    with open(fileName, 'w', encoding='utf-8') as f:
+        f.write("".join(l_xml))
+
+def generate_dump(output, banks = 20, wems = 50, vo_ratio = 0.5, min_size = 2048, max_size = 65536, precache_size = 1024, memory_ratio = 0.1, variant_ratio = 0.1, shared_ratio = 0.1, seed = 0):
+    """
+    Generate a synthetic game audio dump in output: bnks with BKHD/DIDX/DATA/HIRC sections, their xmls, loose streamed wems and a locres json.
+    Every bank gets `wems` wems of which memory_ratio only exist inside the bnk, the rest are loose files with the first precache_size bytes precached in the bnk.
+    variant_ratio of the short names map to two different wem ids (half of them identical copies), and shared_ratio of the precached wems are also precached by the next bnk.
+    Returns a summary of what was generated.
+    """
+    random.seed(seed)
+    os.makedirs(output, exist_ok=True)
+    d_summary = {"banks": 0, "vo_banks": 0, "loose_wems": 0, "bnk_only_wems": 0, "shared_precache": 0, "loose_bytes": 0, "vo_names": [], "sfx_names": []}
+    d_locres = {}
+    i_next_id = 100000
+    l_precache_by_bank = []
+    l_bank_specs = []
+
+    for bank_idx in range(banks):
+        b_vo = bank_idx < int(banks * vo_ratio)
+        bnk_short_name = f"VO_gen_{bank_idx:04d}" if b_vo else f"sfx_gen_{bank_idx:04d}"
+        l_events = []
+        l_precache = []
+        for wem_idx in range(wems):
+            if b_vo:
+                short_name = f"vo_cin_{bank_idx:04d}_{wem_idx:03d}_{random.choice(l_characters)}"
+                d_locres[f"ST_{bank_idx}_{short_name}"] = f"Synthetic line {bank_idx}-{wem_idx}"
+            else:
+                short_name = f"sfx_gen_{bank_idx:04d}_{wem_idx:03d}"
+            l_ids = [i_next_id]
+            i_next_id += 1
+            if random.random() < variant_ratio:
+                l_ids.append(i_next_id)
+                i_next_id += 1
+            l_streamed = []
+            l_memory = []
+            # Half of the variants are identical copies, which is what makes create_hash_pairs hash them
+            b_identical_variants = random.random() < 0.5
+            payload = None
+            for wem_id in l_ids:
+                file_entry = (wem_id, short_name, f"{short_name}_{random.getrandbits(32):08X}")
+                if random.random() < memory_ratio:
+                    l_memory.append(file_entry)
+                    l_precache.append((wem_id, os.urandom(random.randint(min_size, max_size) // 4)))
+                    d_summary["bnk_only_wems"] += 1
+                    continue
+                l_streamed.append(file_entry)
+                if payload is None or not b_identical_variants:
+                    payload = os.urandom(random.randint(min_size, max_size))
+                with open(os.path.join(output, f"{wem_id}.wem"), 'wb') as f:
+                    f.write(payload)
+                d_summary["loose_wems"] += 1
+                d_summary["loose_bytes"] += len(payload)
+                l_precache.append((wem_id, payload[:precache_size]))
+            l_events.append((f"Play_{short_name}", l_streamed, l_memory))
+            d_summary["vo_names" if b_vo else "sfx_names"].append((bnk_short_name, short_name, l_ids[0]))
+        l_precache_by_bank.append(l_precache)
+        l_bank_specs.append((bnk_short_name, l_events))
+
+    for bank_idx, (bnk_short_name, l_events) in enumerate(l_bank_specs):
+        l_wems = list(l_precache_by_bank[bank_idx])
+        if bank_idx > 0:
+            l_previous = l_precache_by_bank[bank_idx - 1]
+            l_shared = random.sample(l_previous, int(len(l_previous) * shared_ratio))
+            s_ids = set(wem_id for wem_id, _ in l_wems)
+            l_wems += [wem for wem in l_shared if wem[0] not in s_ids]
+            d_summary["shared_precache"] += len(l_shared)
+        write_bnk(os.path.join(output, bnk_short_name + ".bnk"), l_wems, [("HIRC", os.urandom(4096)), ("STID", os.urandom(64))])
+        write_xml(os.path.join(output, bnk_short_name + ".xml"), bnk_short_name, l_events, [])
+        d_summary["banks"] += 1
+        d_summary["vo_banks"] += bnk_short_name.startswith("VO")
+
+    # A few loose wems no xml references, like the real dump has
+    for _ in range(max(1, banks // 10)):
+        with open(os.path.join(output, f"{i_next_id}.wem"), 'wb') as f:
+            f.write(os.urandom(min_size))
+        i_next_id += 1
+    with open(os.path.join(output, "locres.json"), 'w') as f:
+        json.dump({"RAP": d_locres}, f)
+    return d_summary
+
+@click.command()
+@click.option("-o", "--output", required=True, help="The folder to generate the synthetic bnks, xmls and wems in.")
+@click.option("--banks", default=20, type=click.IntRange(min=1), help="The number of bnks to generate.")
+@click.option("--wems", default=50, type=click.IntRange(min=1), help="The number of wem names per bnk.")
+@click.option("--vo-ratio", default=0.5, type=click.FloatRange(0, 1), help="The fraction of bnks which are VO bnks.")
+@click.option("--min-size", default=2048, type=click.IntRange(min=16), help="The smallest loose wem size in bytes.")
+@click.option("--max-size", default=65536, type=click.IntRange(min=16), help="The largest loose wem size in bytes.")
+@click.option("--precache-size", default=1024, type=click.IntRange(min=1), help="The number of bytes of each loose wem precached in its bnk.")
+@click.option("--shared-ratio", default=0.1, type=click.FloatRange(0, 1), help="The fraction of each bnk's precached wems also precached by the next bnk.")
+@click.option("--seed", default=0, help="The random seed, the same seed always generates the same layout.")
+def generate(output, banks, wems, vo_ratio, min_size, max_size, precache_size, shared_ratio, seed):
+    """Generate a synthetic game audio dump for benchmarking or testing without the game files."""
+    d_summary = generate_dump(output, banks, wems, vo_ratio, min_size, max_size, precache_size, shared_ratio=shared_ratio, seed=seed)
+    print(f"Generated {d_summary['banks']} bnks, {d_summary['loose_wems']} loose wems and {d_summary['bnk_only_wems']} bnk only wems in {output}")
+
+def run_command(l_args):
+    """Run a js-audioops command in a fresh interpreter, as a user would, returning its wall time."""
+    f_start = time.perf_counter()
+    subprocess.run([sys.executable, s_script_path] + l_args, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - f_start
+
+def time_call(function, repeats):
+    l_times = []
+    for _ in range(repeats):
+        f_start = time.perf_counter()
+        function()
+        l_times.append(time.perf_counter() - f_start)
+    return {"seconds": min(l_times), "mean_seconds": sum(l_times) / len(l_times), "repeats": repeats}
+
+def make_wem_folder(folder, l_names, payload_size = 4096):
+    """Create a reimport --wemfolder: VO wems at the root with the default suffix, SFX wems in subfolders named after their bnk."""
+    os.makedirs(folder, exist_ok=True)
+    for bnk_short_name, short_name, _ in l_names:
+        if bnk_short_name.startswith("VO"):
+            s_wem_path = os.path.join(folder, short_name + "_3F75BDB9.wem")
+        else:
+            os.makedirs(os.path.join(folder, bnk_short_name), exist_ok=True)
+            s_wem_path = os.path.join(folder, bnk_short_name, short_name + ".wem")
+        with open(s_wem_path, 'wb') as f:
+            f.write(os.urandom(payload_size))
+
+@click.command()
+@click.option("-o", "--output", help="The json file to write the results to. They are printed if this is left blank.")
+@click.option("--banks", default=40, type=click.IntRange(min=1), help="The number of bnks to generate.")
+@click.option("--wems", default=100, type=click.IntRange(min=1), help="The number of wem names per bnk.")
+@click.option("--max-size", default=65536, type=click.IntRange(min=16), help="The largest loose wem size in bytes.")
+@click.option("--shared-ratio", default=0.1, type=click.FloatRange(0, 1), help="The fraction of each bnk's precached wems also precached by the next bnk.")
+@click.option("--jobs", default=4, type=click.IntRange(min=1), help="The --jobs used for the parallel scenarios.")
+@click.option("--repeats", default=3, type=click.IntRange(min=1), help="How many times the in-process scenarios are repeated, the fastest time is reported.")
+@click.option("--workdir", help="The folder to generate data in. A temporary folder is used and removed afterwards if this is left blank.")
+def run(output, banks, wems, max_size, shared_ratio, jobs, repeats, workdir):
+    """Benchmark bnk/xml parsing, bnk building, hashing and the extract/reimport commands on a synthetic dump, reporting the results as json."""
+    s_workdir = workdir if workdir is not None else tempfile.mkdtemp(prefix="audioops-bench-")
+    s_input = os.path.join(s_workdir, "input")
+    shutil.rmtree(s_input, ignore_errors=True)
+    d_summary = generate_dump(s_input, banks, wems, max_size=max_size, shared_ratio=shared_ratio)
+    l_bnks = sorted(file for file in os.listdir(s_input) if file.endswith(".bnk"))
+    l_xmls = sorted(file for file in os.listdir(s_input) if file.endswith(".xml"))
+    s_cache = os.path.join(s_input, ".audioops_cache")
+    d_scenarios = {}
+
+    try:
+        def parse_bnks():
+            for bnk_name in l_bnks:
+                with js_audioops.BnkObject(os.path.join(s_input, bnk_name)) as o_bnk:
+                    for wemId in o_bnk.Data:
+                        o_bnk.Data.size(wemId)
+        d_scenarios["parse_bnks"] = time_call(parse_bnks, repeats)
+
+        s_build_folder = os.path.join(s_workdir, "build")
+        os.makedirs(s_build_folder, exist_ok=True)
+        def build_bnks(b_same_size):
+            for bnk_name in l_bnks:
+                with js_audioops.BnkObject(os.path.join(s_input, bnk_name)) as o_bnk:
+                    for wemId in list(o_bnk.Data)[:1]:
+                        o_bnk.Data[wemId] = bytes(o_bnk.Data.size(wemId) if b_same_size else o_bnk.Data.size(wemId) + 7)
+                    o_bnk.build(os.path.join(s_build_folder, bnk_name))
+        d_scenarios["build_bnks_same_size"] = time_call(lambda: build_bnks(True), repeats)
+        d_scenarios["build_bnks_resized"] = time_call(lambda: build_bnks(False), repeats)
+
+        def parse_xmls(b_cold):
+            for xml_name in l_xmls:
+                if b_cold:
+                    shutil.rmtree(s_cache, ignore_errors=True)
+                js_audioops.BnkXmlObject(os.path.join(s_input, xml_name))
+        d_scenarios["parse_xmls_cold"] = time_call(lambda: parse_xmls(True), repeats)
+        parse_xmls(False)
+        d_scenarios["parse_xmls_cached"] = time_call(lambda: parse_xmls(False), repeats)
+
+        l_xml_objects = [js_audioops.BnkXmlObject(os.path.join(s_input, xml_name)) for xml_name in l_xmls]
+        def hash_pairs(b_cold):
+            if b_cold:
+                js_audioops.d_hash_caches.clear()
+                if os.path.exists(os.path.join(s_cache, "md5_cache.json")):
+                    os.remove(os.path.join(s_cache, "md5_cache.json"))
+            for o_xml_file in l_xml_objects:
+                o_xml_file.create_hash_pairs(s_input)
+        d_scenarios["create_hash_pairs_cold"] = time_call(lambda: hash_pairs(True), repeats)
+        d_scenarios["create_hash_pairs_cached"] = time_call(lambda: hash_pairs(False), repeats)
+
+        def iter_records():
+            for _ in js_audioops.iter_records(s_input, os.path.join(s_input, "locres.json")):
+                pass
+        d_scenarios["iter_records_metadata"] = time_call(iter_records, repeats)
+
+        l_vo_names = [short_name for _, short_name, _ in d_summary["vo_names"]]
+        d_scenarios["resolve_characters_cold"] = time_call(lambda: js_audioops.CharacterResolver().resolve_many(l_vo_names), repeats)
+        d_scenarios["load_locres_cold"] = time_call(lambda: (shutil.rmtree(os.path.join(s_cache, "locres"), ignore_errors=True), js_audioops.load_locres(os.path.join(s_input, "locres.json"))), repeats)
+        d_scenarios["load_locres_cached"] = time_call(lambda: js_audioops.load_locres(os.path.join(s_input, "locres.json")), repeats)
+
+        s_extract = os.path.join(s_workdir, "extract")
+        def extract(l_extra_args, b_cold):
+            shutil.rmtree(s_extract, ignore_errors=True)
+            if b_cold:
+                shutil.rmtree(s_cache, ignore_errors=True)
+            return run_command(["extract-wems", "-i", s_input, "-o", s_extract, "-l", os.path.join(s_input, "locres.json")] + l_extra_args)
+        d_scenarios["extract_full_cold"] = {"seconds": extract([], True)}
+        d_scenarios["extract_full_warm"] = {"seconds": extract([], False)}
+        d_scenarios["extract_full_jobs"] = {"seconds": extract(["--jobs", str(jobs)], False), "jobs": jobs}
+
+        s_wems = os.path.join(s_workdir, "wems")
+        s_reimport = os.path.join(s_workdir, "reimport")
+        def reimport(b_clean_output, l_extra_args = []):
+            if b_clean_output:
+                shutil.rmtree(s_reimport, ignore_errors=True)
+            return run_command(["reimport-wems", "-w", s_wems, "-b", s_input, "-o", s_reimport] + l_extra_args)
+
+        shutil.rmtree(s_wems, ignore_errors=True)
+        make_wem_folder(s_wems, d_summary["vo_names"][:1])
+        d_scenarios["reimport_single"] = {"seconds": reimport(True)}
+
+        shutil.rmtree(s_wems, ignore_errors=True)
+        l_all_names = d_summary["vo_names"] + d_summary["sfx_names"]
+        make_wem_folder(s_wems, l_all_names)
+        d_scenarios["reimport_full"] = {"seconds": reimport(True), "wems": len(l_all_names)}
+        d_scenarios["reimport_full_jobs"] = {"seconds": reimport(True, ["--jobs", str(jobs)]), "wems": len(l_all_names), "jobs": jobs}
+        make_wem_folder(s_wems, d_summary["vo_names"][:1])
+        d_scenarios["reimport_full_one_changed"] = {"seconds": reimport(False)}
+
+        # What watch does after a wem is edited: the bnks stay indexed in memory and only the wem folder is gone through again
+        o_banks = js_audioops.ReimportBanks(s_input)
+        o_manifest = js_audioops.ReimportManifest(s_reimport)
+        def reimport_warm():
+            make_wem_folder(s_wems, d_summary["vo_names"][:1])
+            o_wem_folder = js_audioops.WemFolderIndex(s_wems, "_3F75BDB9")
+            with contextlib.redirect_stdout(io.StringIO()):
+                js_audioops.reimport(o_wem_folder, o_banks, s_reimport, o_manifest, map, False)
+            o_manifest.next_run()
+        d_scenarios["watch_one_changed"] = time_call(reimport_warm, repeats)
+        d_scenarios["verify_bnks"] = {"seconds": run_command(["verify-bnks", "-b", s_input, "-o", s_reimport, "-r", os.path.join(s_workdir, "VerifyReport.json")])}
+        d_scenarios["verify_bnks_jobs"] = {"seconds": run_command(["verify-bnks", "-b", s_input, "-o", s_reimport, "-r", os.path.join(s_workdir, "VerifyReport.json"), "--jobs", str(jobs)]), "jobs": jobs}
+    finally:
+        if workdir is None:
+            shutil.rmtree(s_workdir, ignore_errors=True)
+
+    del d_summary["vo_names"]
+    del d_summary["sfx_names"]
+    d_results = {
+        "version": 1,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {"banks": banks, "wems": wems, "max_size": max_size, "shared_ratio": shared_ratio, "jobs": jobs, "repeats": repeats},
+        "generated": d_summary,
+        "scenarios": d_scenarios,
+    }
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(d_results, f, indent=2)
+    else:
+        print(json.dumps(d_results, indent=2))
+
+mycommands.add_command(generate)
+mycommands.add_command(run)
+if __name__ == "__main__":
+    mycommands()
@@ -1,10 +1,22 @@
-import copy
 import csv
+import fnmatch
 import hashlib
 import json
+import mmap
 import os
 import shutil
+import sqlite3
+import struct
+import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from itertools import repeat
 
 import click 
 
@@ -18,55 +30,125 @@ class BnkXmlObject:
     This class is only designed to read the xmls as from my tests there doesn't appear to be any need to modify the contents, though some specific situations may require the precache size or length to be modified.
     There are also json files which (hopefully) contains the same information as the xmls, thus making parsing them redundant unless they need to be modified in the reimport stage.
     """
+    VERSION = 2
+
     def __init__(self, s_file_name):
         self.FileData = {}
-        _tree = ET.parse(s_file_name)
-        if (_tree.getroot().find("SoundBanks") is None):
-                return
-        for e_sound_bank in _tree.getroot().find("SoundBanks").findall("SoundBank"):
-            if (e_sound_bank.find("IncludedEvents") is None):
-                if (e_sound_bank.find("ReferencedStreamedFiles") is not None or e_sound_bank.find("ReferencedStreamedFiles") is not None):
-                     raise Exception("Logic error")
+        try:
+            xml_stat = os.stat(s_file_name)
+        except OSError:
+            xml_stat = None
+        # json rather than pickle, as loading a pickle from a shared folder could run anything
+        s_cache_file = get_cache_file(os.path.dirname(s_file_name), os.path.join("xml", os.path.basename(s_file_name) + ".json"))
+        if xml_stat is not None and os.path.isfile(s_cache_file):
+            try:
+                with o_run_stats.phase("xml_cache", files=1), open(s_cache_file, 'r') as f:
+                    cached = json.load(f)
+                if cached["version"] == self.VERSION and cached["size"] == xml_stat.st_size and cached["mtime_ns"] == xml_stat.st_mtime_ns:
+                    for short_name, d_files, l_events in cached["banks"]:
+                        self.FileData[short_name] = WemXmlObject(short_name, d_files, l_events)
+                    return
+            except (OSError, KeyError, IndexError, TypeError, ValueError):
+                self.FileData = {}
+
+        with o_run_stats.phase("xml_parse", bytes_read=xml_stat.st_size if xml_stat is not None else 0, files=1):
+            self.parse(s_file_name)
+        if xml_stat is not None:
+            l_records = [[short_name, o_xml_wem.Files, o_xml_wem.Events] for short_name, o_xml_wem in self.FileData.items()]
+            save_cache_file(s_cache_file, {"version": self.VERSION, "size": xml_stat.st_size, "mtime_ns": xml_stat.st_mtime_ns, "banks": l_records})
+
+    def parse(self, s_file_name):
+        """
+        Stream the xml with iterparse rather than building the whole tree, keeping only the <File> entries of the current SoundBank in memory.
+        Files are added in the same order as walking the tree would: each event's streamed then memory files, followed by the SoundBank's own files under the name of its last event.
+        """
+        l_path = []
+        event_name = None
+        i_sound_banks = 0
+        for parse_event, e_element in ET.iterparse(s_file_name, events=("start", "end")):
+            if parse_event == "start":
+                l_path.append(e_element.tag)
+                i_depth = len(l_path)
+                if i_depth == 2 and e_element.tag == "SoundBanks":
+                    i_sound_banks += 1
+                if i_sound_banks != 1 or i_depth < 3 or l_path[1] != "SoundBanks" or l_path[2] != "SoundBank":
+                    continue
+                if i_depth == 3:
+                    b_has_events = False
+                    b_has_streamed = False
+                    d_bank_files = {"ReferencedStreamedFiles" : [], "IncludedMemoryFiles" : []}
+                elif i_depth == 4 and e_element.tag == "IncludedEvents":
+                    b_has_events = True
+                elif i_depth == 4 and e_element.tag == "ReferencedStreamedFiles":
+                    b_has_streamed = True
+                elif i_depth == 5 and l_path[3] == "IncludedEvents" and e_element.tag == "Event":
+                    event_name = e_element.attrib["Name"]
+                    d_event_files = {"ReferencedStreamedFiles" : [], "IncludedMemoryFiles" : []}
+                continue
+
+            i_depth = len(l_path)
+            b_in_sound_bank = i_sound_banks == 1 and i_depth >= 3 and l_path[1] == "SoundBanks" and l_path[2] == "SoundBank"
+            l_path.pop()
+            if not b_in_sound_bank:
                 continue
-            for e_included_events in e_sound_bank.find("IncludedEvents").findall("Event"):
-                event_name = e_included_events.attrib["Name"]
-                self.read_file_data(e_included_events, "ReferencedStreamedFiles", event_name)
-                self.read_file_data(e_included_events, "IncludedMemoryFiles", event_name)
-            self.read_file_data(e_sound_bank, "ReferencedStreamedFiles", event_name)
-            self.read_file_data(e_sound_bank, "IncludedMemoryFiles", event_name)
-
-    def read_file_data(cls, e_fileevents, events_name, cak_name = None):
-        if (e_fileevents.find(events_name) is not None):
-            for e_file in e_fileevents.find(events_name).findall("File"):
-                o_xml_wem = WemXmlObject(e_file, cak_name)
-
-                if o_xml_wem.ShortName not in cls.FileData:
-                    cls.FileData[o_xml_wem.ShortName] = o_xml_wem
+            if e_element.tag == "File" and i_depth == 5 and l_path[3] in d_bank_files:
+                d_bank_files[l_path[3]].append(self.read_file_element(e_element))
+            elif e_element.tag == "File" and i_depth == 7 and l_path[3] == "IncludedEvents" and l_path[4] == "Event" and l_path[5] in d_event_files:
+                d_event_files[l_path[5]].append(self.read_file_element(e_element))
+            elif i_depth == 5 and l_path[3] == "IncludedEvents" and e_element.tag == "Event":
+                for l_files in d_event_files.values():
+                    for short_name, file_id, path in l_files:
+                        self.add_file(short_name, file_id, path, event_name)
+                e_element.clear()
+            elif i_depth == 3:
+                if not b_has_events:
+                    if b_has_streamed:
+                        raise Exception("Logic error")
                 else:
-                    if len(o_xml_wem.Events) > 0 and o_xml_wem.Events[0] not in cls.FileData[o_xml_wem.ShortName].Events:
-                        cls.FileData[o_xml_wem.ShortName].Events.append(o_xml_wem.Events[0])
-                    if list(o_xml_wem.Files.keys())[0] not in  cls.FileData[o_xml_wem.ShortName].Files:
-                        cls.FileData[o_xml_wem.ShortName].Files[list(o_xml_wem.Files.keys())[0]] = list(o_xml_wem.Files.values())[0]
+                    for l_files in d_bank_files.values():
+                        for short_name, file_id, path in l_files:
+                            self.add_file(short_name, file_id, path, event_name)
+                e_element.clear()
 
-    def create_hash_pairs(cls, wem_directory, hash_to_unhash = True):
+    def read_file_element(cls, e_file):
+        return (e_file.find("ShortName").text.split(".")[0], e_file.attrib["Id"], e_file.find("Path").text.split(".")[0])
+
+    def add_file(cls, short_name, file_id, path, event_name = None):
+        if short_name not in cls.FileData:
+            cls.FileData[short_name] = WemXmlObject(short_name, {file_id : path}, [] if event_name == None else [event_name])
+        else:
+            if event_name != None and event_name not in cls.FileData[short_name].Events:
+                cls.FileData[short_name].Events.append(event_name)
+            if file_id not in cls.FileData[short_name].Files:
+                cls.FileData[short_name].Files[file_id] = path
+
+    def create_hash_pairs(cls, wem_directory, hash_to_unhash = True, hash_cache = None):
+        if hash_cache is None:
+            hash_cache = get_hash_cache(wem_directory)
         d_pairs = {}
         for short_name in cls.FileData:
             add_suffix = False
             if len(cls.FileData[short_name].Files) > 1:
-                current_hash = None
+                # Files of different sizes can't be identical, so they only need hashing when every one exists with the same size
+                l_wem_stats = []
                 for hash_name in cls.FileData[short_name].Files:
-                    hash_file = os.path.join(wem_directory, hash_name + ".wem")
-                    if os.path.exists(hash_file):
-                        new_hash = md5(hash_file)
-                        if new_hash != current_hash:
-                            if current_hash == None:
-                                current_hash = new_hash
-                            else:
-                                add_suffix = True
-                                break
-                    else:
+                    try:
+                        l_wem_stats.append((hash_name + ".wem", os.stat(os.path.join(wem_directory, hash_name + ".wem"))))
+                    except OSError:
+                        hash_cache.evict(hash_name + ".wem")
                         add_suffix = True
                         break
+                if not add_suffix and len(set(wem_stat.st_size for _, wem_stat in l_wem_stats)) > 1:
+                    add_suffix = True
+                if not add_suffix:
+                    current_hash = None
+                    for wem_name, wem_stat in l_wem_stats:
+                        new_hash = hash_cache.md5(wem_name, wem_stat)
+                        if current_hash == None:
+                            current_hash = new_hash
+                        elif new_hash != current_hash:
+                            add_suffix = True
+                            break
 
             for hash_name in cls.FileData[short_name].Files:
                 unhashed_name = short_name
@@ -86,95 +168,1005 @@ class WemXmlObject:
     """
     Class containing wem data found in XML files.
     """
-    def __init__(self, e_xml_file_object, event = None):
-        self.ShortName = e_xml_file_object.find("ShortName").text.split(".")[0]
-        self.Files = {
-            e_xml_file_object.attrib["Id"] : e_xml_file_object.find("Path").text.split(".")[0]
-        }
-        self.Events = []
-        if event != None:
-            self.Events.append(event)
+    __slots__ = ("ShortName", "Files", "Events")
+
+    def __init__(self, short_name, files, events):
+        self.ShortName = short_name
+        self.Files = files
+        self.Events = events
 
 
 class wemDidx:
+    __slots__ = ("WemId", "WemOffset", "WemSize")
+
     def __init__(self, wemId, wemOffset, wemSize):
         self.WemId = wemId
         self.WemOffset = wemOffset
         self.WemSize = wemSize
-    def __init__(self, f):
-        self.WemId = int.from_bytes(f.read(4), byteorder='little')
-        self.WemOffset = int.from_bytes(f.read(4), byteorder='little')
-        self.WemSize = int.from_bytes(f.read(4), byteorder='little')
     def __str__(self):
         return '\t'.join(str(item) for item in [self.WemId, self.WemOffset, self.WemSize])
 
+class BnkData(MutableMapping):
+    """
+    Dict-like view of the wems embedded in a bnk's DATA section, keyed by wem id in DIDX order.
+    Reading an entry returns a zero-copy memoryview over the bnk's memory map, assigning an entry stores the replacement payload so only modified wems are ever held in memory.
+    """
+    def __init__(self, view, didx):
+        self._view = view
+        self._entries = {didx_entry.WemId : didx_entry for didx_entry in didx}
+        self._replaced = {}
+
+    def __getitem__(self, wemId):
+        if wemId in self._replaced:
+            return self._replaced[wemId]
+        didx_entry = self._entries[wemId]
+        return self._view[didx_entry.WemOffset:didx_entry.WemOffset + didx_entry.WemSize]
+
+    def __setitem__(self, wemId, data):
+        if wemId not in self._entries:
+            self._entries[wemId] = None
+        self._replaced[wemId] = data
+
+    def __delitem__(self, wemId):
+        del self._entries[wemId]
+        self._replaced.pop(wemId, None)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, wemId):
+        return wemId in self._entries
+
+    def is_replaced(self, wemId):
+        return wemId in self._replaced
+
+    def source_entry(self, wemId):
+        """DIDX entry of the wem in the source bnk, or None if its payload has been replaced."""
+        if wemId in self._replaced:
+            return None
+        return self._entries[wemId]
+
+    def size(self, wemId):
+        """Size of a wem in bytes without touching its payload."""
+        if wemId in self._replaced:
+            return len(self._replaced[wemId])
+        return self._entries[wemId].WemSize
+
+    def read(self, wemId):
+        """Materialise a single wem as bytes."""
+        return bytes(self[wemId])
+
+    def load(self):
+        """Materialise every wem so the bnk no longer depends on its source file."""
+        for wemId in self._entries:
+            if wemId not in self._replaced:
+                self._replaced[wemId] = self.read(wemId)
+
 class BnkObject:
+    """
+    Class to read and rebuild Wwise soundbanks.
+    The bnk is memory mapped and only the BKHD/DIDX headers and trailing sections are parsed up front, wem payloads are sliced out of DATA on demand through self.Data.
+    Call close() (or use the object as a context manager) once finished with it so the file is released.
+    """
     def __init__(self, fileName):
+        self.FileName = fileName
+        self.BKHD = b""
         self.Didx = []
-        self.Data = {}
         self.Sec = {}
-        with open(fileName, 'rb') as f:
-            if f.read(4).decode("utf-8") != "BKHD":
-                raise Exception(f" {fileName} did not parse correctly. Lacks BKHD")
-            self.BKHD = f.read(int.from_bytes(f.read(4), byteorder='little'))
-            #f.seek(int.from_bytes(f.read(4), byteorder='little')+8)
+        self.DataOffset = None
+        self.HeaderSize = 0
+        self._sourceLayout = None
+        self._file = open(fileName, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b""
+        view = memoryview(self._map)
+        self.Data = BnkData(view[0:0], [])
 
-            if f.read(4).decode("utf-8") != "DIDX":
-                return
-                #raise Exception(f" {fileName} did not parse correctly. Lacks DIDX")
-
-            wemCount = int(int.from_bytes(f.read(4), byteorder='little')/12)
-            self.Didx = [wemDidx(f) for wemIdx in range(0, wemCount)] 
-
-            if f.read(4).decode("utf-8") != "DATA":
-                raise Exception(f" {fileName} did not parse correctly. Lacks DATA")
-            dataSize = int(int.from_bytes(f.read(4), byteorder='little'))
-            dataOffset = f.tell()
-            self.Data = {}
-            for didx in self.Didx:
-                f.seek(dataOffset + didx.WemOffset)
-                self.Data[didx.WemId] = f.read(didx.WemSize)
-
-            while True:
-                secType = f.read(4).decode("utf-8")
-                if secType == "":
-                    break
-                self.Sec[secType] =  f.read(int.from_bytes(f.read(4), byteorder='little'))
+        if bytes(view[0:4]) != b"BKHD":
+            self.close()
+            raise Exception(f" {fileName} did not parse correctly. Lacks BKHD")
+        bkhdSize, = struct.unpack_from("<I", view, 4)
+        self.BKHD = bytes(view[8:8 + bkhdSize])
+        pos = 8 + bkhdSize
+        self.HeaderSize = min(pos, len(view))
+
+        if bytes(view[pos:pos + 4]) != b"DIDX":
+            return
+            #raise Exception(f" {fileName} did not parse correctly. Lacks DIDX")
+        didxSize, = struct.unpack_from("<I", view, pos + 4)
+        pos += 8
+        didxSize -= didxSize % 12
+        self.Didx = [wemDidx(*entry) for entry in struct.iter_unpack("<III", view[pos:pos + didxSize])]
+        pos += didxSize
+
+        if bytes(view[pos:pos + 4]) != b"DATA":
+            self.close()
+            raise Exception(f" {fileName} did not parse correctly. Lacks DATA")
+        dataSize, = struct.unpack_from("<I", view, pos + 4)
+        pos += 8
+        self.DataOffset = pos
+        self.Data = BnkData(view[pos:pos + dataSize], self.Didx)
+        pos += dataSize
+
+        while pos + 8 <= len(view):
+            secType = bytes(view[pos:pos + 4]).decode("utf-8")
+            secSize, = struct.unpack_from("<I", view, pos + 4)
+            self.Sec[secType] = bytes(view[pos + 8:pos + 8 + secSize])
+            pos += 8 + secSize
+        # Everything but the wem payloads is read up front
+        self.HeaderSize = min(pos, len(view)) - dataSize
+
+        self._sourceBKHD = self.BKHD
+        self._sourceSec = dict(self.Sec)
+        if pos == len(view) and didxSize == len(self.Data) * 12:
+            self._sourceLayout = ([(didx.WemId, didx.WemOffset, didx.WemSize) for didx in self.Didx], dataSize)
+
+    def close(self):
+        self.Data._view.release()
+        try:
+            if isinstance(self._map, mmap.mmap):
+                self._map.close()
+        except BufferError:
+            # Slices of the map are still referenced elsewhere, it will be unmapped once they are garbage collected
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def layout(self):
+        """Compute the DIDX entries the bnk will be written with, along with the resulting DATA size."""
+        l_didx = []
+        dataSize = 0
+        for wemId in self.Data:
+            if dataSize % 16 != 0:
+                dataSize += 16 - dataSize % 16
+            l_didx.append(wemDidx(int(wemId), dataSize, self.Data.size(wemId)))
+            dataSize += self.Data.size(wemId)
+        return l_didx, dataSize
+
+    def can_patch(self, l_didx, dataSize):
+        """True if building would only change payload bytes in place, i.e. every entry keeps its id, offset and size."""
+        if self.DataOffset is None or self._sourceLayout is None:
+            return False
+        if self.BKHD != self._sourceBKHD or self.Sec != self._sourceSec:
+            return False
+        return self._sourceLayout == ([(didx.WemId, didx.WemOffset, didx.WemSize) for didx in l_didx], dataSize)
 
     def build(self, fileName):
-        with open(fileName, 'wb') as f:
-            f.write("BKHD".encode())
-            f.write((len(self.BKHD)).to_bytes(4, byteorder='little'))
-            f.write(self.BKHD)
-
-            f.write("DIDX".encode())
-            f.write((len(self.Didx)*12).to_bytes(4, byteorder='little'))
-            b_DataStream = bytearray()
-            for wemId in self.Data:
-                if len(b_DataStream) % 16 != 0:
-                    b_DataStream += bytes(16-len(b_DataStream) % 16)
-                f.write((int(wemId)).to_bytes(4, byteorder='little'))
-                f.write((len(b_DataStream)).to_bytes(4, byteorder='little'))
-                f.write((len(self.Data[wemId])).to_bytes(4, byteorder='little'))
-                b_DataStream += self.Data[wemId]
-
-            f.write("DATA".encode())
-            f.write(len(b_DataStream).to_bytes(4, byteorder='little'))
-            f.write(b_DataStream)
+        l_didx, dataSize = self.layout()
+        b_sameFile = os.path.exists(fileName) and os.path.samefile(fileName, self.FileName)
+
+        if self.can_patch(l_didx, dataSize):
+            if not b_sameFile:
+                copy_file(self.FileName, fileName)
+            with open(fileName, 'r+b') as f:
+                for didx in l_didx:
+                    if self.Data.is_replaced(didx.WemId):
+                        f.seek(self.DataOffset + didx.WemOffset)
+                        f.write(self.Data[didx.WemId])
+            return
 
+        if b_sameFile:
+            # The source is about to be truncated, so nothing can be copied out of it while writing
+            self.Data.load()
+
+        b_header = bytearray()
+        b_header += "BKHD".encode()
+        b_header += len(self.BKHD).to_bytes(4, byteorder='little')
+        b_header += self.BKHD
+        b_header += "DIDX".encode()
+        b_header += (len(l_didx)*12).to_bytes(4, byteorder='little')
+        for didx in l_didx:
+            b_header += struct.pack("<III", didx.WemId, didx.WemOffset, didx.WemSize)
+        b_header += "DATA".encode()
+        b_header += dataSize.to_bytes(4, byteorder='little')
+
+        with open(fileName, 'wb', buffering=0) as f:
+            f.write(b_header)
+            # Runs of untouched wems are copied straight from the source bnk, merged while they stay contiguous
+            i_runStart = None
+            i_runEnd = None
+            i_written = 0
+            for didx in l_didx:
+                i_padding = didx.WemOffset - i_written
+                source_didx = self.Data.source_entry(didx.WemId)
+                if source_didx is not None:
+                    i_sourceStart = source_didx.WemOffset - i_padding
+                    if i_runEnd is not None and i_runEnd == i_sourceStart and not any(self.Data._view[i_runEnd:source_didx.WemOffset]):
+                        i_runEnd = source_didx.WemOffset + didx.WemSize
+                    else:
+                        if i_runStart is not None:
+                            copy_file_range(self._file, f, self.DataOffset + i_runStart, i_runEnd - i_runStart)
+                        f.write(bytes(i_padding))
+                        i_runStart = source_didx.WemOffset
+                        i_runEnd = source_didx.WemOffset + didx.WemSize
+                else:
+                    if i_runStart is not None:
+                        copy_file_range(self._file, f, self.DataOffset + i_runStart, i_runEnd - i_runStart)
+                        i_runStart = None
+                        i_runEnd = None
+                    f.write(bytes(i_padding))
+                    f.write(self.Data[didx.WemId])
+                i_written = didx.WemOffset + didx.WemSize
+            if i_runStart is not None:
+                copy_file_range(self._file, f, self.DataOffset + i_runStart, i_runEnd - i_runStart)
+
+            b_trailer = bytearray()
             for secName in self.Sec:
-                f.write(secName.encode())
-                f.write(len(self.Sec[secName]).to_bytes(4, byteorder='little'))
-                f.write(self.Sec[secName])
+                b_trailer += secName.encode()
+                b_trailer += len(self.Sec[secName]).to_bytes(4, byteorder='little')
+                b_trailer += self.Sec[secName]
+            f.write(b_trailer)
+
+
+b_use_copy_file_range = hasattr(os, "copy_file_range")
+b_use_sendfile = hasattr(os, "sendfile") and sys.platform.startswith("linux")
+# How much of a file is read into memory at once when copying or hashing it, lowered by extract-wems --max-memory
+i_buffer_size = 1 << 20
+
+def copy_file_range(src, dst, offset, count):
+    """Append count bytes read from offset in src to dst, letting the kernel move the data when the platform allows it."""
+    global b_use_copy_file_range, b_use_sendfile
+    while count > 0:
+        i_copied = 0
+        try:
+            if b_use_copy_file_range:
+                i_copied = os.copy_file_range(src.fileno(), dst.fileno(), count, offset)
+            elif b_use_sendfile:
+                i_copied = os.sendfile(dst.fileno(), src.fileno(), offset, count)
+        except OSError:
+            # Unsupported for this pair of files (e.g. across filesystems), fall back to plain reads from here on
+            if b_use_copy_file_range:
+                b_use_copy_file_range = False
+            else:
+                b_use_sendfile = False
+            continue
+        if i_copied == 0:
+            src.seek(offset)
+            chunk = src.read(min(count, i_buffer_size))
+            if len(chunk) == 0:
+                raise Exception(f" {src.name} ended before {count} more bytes could be copied from it")
+            dst.write(chunk)
+            i_copied = len(chunk)
+        offset += i_copied
+        count -= i_copied
+
+def copy_file(src, dst):
+    """Copy a whole file, using copy_file_range where available so copy-on-write filesystems can share the data."""
+    with open(src, 'rb') as f_src, open(dst, 'wb', buffering=0) as f_dst:
+        copy_file_range(f_src, f_dst, 0, os.fstat(f_src.fileno()).st_size)
+
+def read_didx(fileName):
+    """Read just the DIDX table of a bnk without mapping or reading its DATA section. Returns the entries and the absolute offset of DATA's payloads."""
+    with open(fileName, 'rb') as f:
+        b_header = f.read(8)
+        if b_header[:4] != b"BKHD":
+            raise Exception(f" {fileName} did not parse correctly. Lacks BKHD")
+        f.seek(int.from_bytes(b_header[4:8], byteorder='little'), os.SEEK_CUR)
+        b_header = f.read(8)
+        if b_header[:4] != b"DIDX":
+            return [], None
+        didxSize = int.from_bytes(b_header[4:8], byteorder='little')
+        b_didx = f.read(didxSize)
+        l_didx = [wemDidx(*entry) for entry in struct.iter_unpack("<III", b_didx[:len(b_didx) - len(b_didx) % 12])]
+        if f.read(8)[:4] != b"DATA":
+            raise Exception(f" {fileName} did not parse correctly. Lacks DATA")
+        return l_didx, f.tell()
+
+class PackedWem:
+    """A wem stored in a WemPack, which reimport-wems treats the same as a path to a loose wem."""
+    __slots__ = ("Pack", "Volume", "RelativePath", "WemHash", "Bnk", "Offset", "Size")
+
+    def __init__(self, pack, volume, relative_path, wem_hash, bnk_name, offset, size):
+        self.Pack = pack
+        self.Volume = volume
+        self.RelativePath = relative_path
+        self.WemHash = wem_hash
+        self.Bnk = bnk_name
+        self.Offset = offset
+        self.Size = size
+
+    def __str__(self):
+        return os.path.join(self.Volume.FileName, self.RelativePath)
+
+    def signature(self):
+        volume_stat = os.stat(self.Volume.FileName)
+        return [str(self), self.Size, volume_stat.st_mtime_ns]
+
+    def read(self, size = None):
+        if size is None or size > self.Size:
+            size = self.Size
+        return bytes(self.Volume._map[self.Offset:self.Offset + size])
+
+    def copy_to(self, fileName):
+        with open(fileName, 'wb') as f:
+            f.write(self.Volume._map[self.Offset:self.Offset + self.Size])
+
+class WemPack:
+    """
+    Reader for the packs extract-wems --output-format pack writes in place of loose wems, with random access by relative path or hash.
+    A pack is laid out like a bnk so BnkObject reads it as is: BKHD, a DIDX entry per wem with sequential ids, DATA and a PKNM section
+    holding the json [relative path, hash, bnk] of each entry. As DATA sizes are 32 bit, packs over 4 GiB are split into volumes named <pack>_1.pack, <pack>_2.pack...
+    """
+    VERSION = 1
+
+    def __init__(self, fileName):
+        self.FileName = fileName
+        self.Volumes = []
+        self.Entries = []
+        self.Paths = {}
+        self.Hashes = {}
+        s_volume_name = fileName
+        while os.path.isfile(s_volume_name):
+            o_volume = BnkObject(s_volume_name)
+            self.Volumes.append(o_volume)
+            if "PKNM" not in o_volume.Sec:
+                self.close()
+                raise Exception(f"{s_volume_name} is not a wem pack")
+            for didx, (relative_path, wem_hash, bnk_name) in zip(o_volume.Didx, json.loads(o_volume.Sec["PKNM"])):
+                o_wem = PackedWem(self, o_volume, relative_path, wem_hash, bnk_name, o_volume.DataOffset + didx.WemOffset, didx.WemSize)
+                self.Entries.append(o_wem)
+                self.Paths[relative_path] = o_wem
+                if wem_hash is not None:
+                    self.Hashes.setdefault(wem_hash, []).append(o_wem)
+            s_volume_name = f"{fileName[:-5]}_{len(self.Volumes)}.pack"
+        if len(self.Volumes) == 0:
+            raise Exception(f"Could not find a wem pack at {fileName}")
+
+    def close(self):
+        for o_volume in self.Volumes:
+            o_volume.close()
+
+    def find_path(self, relative_path):
+        return self.Paths.get(relative_path)
+
+    def find_hash(self, wem_hash):
+        return self.Hashes.get(wem_hash, [])
+
+def write_pack(fileName, l_entries):
+    """
+    Write (relative path, hash, bnk, source file, offset, size) entries to a wem pack, copying each payload straight from its source file.
+    Entries whose relative path was already written are skipped, the same as a later loose wem overwriting an earlier identical one.
+    """
+    d_entries = {}
+    for entry in l_entries:
+        if entry[0] not in d_entries:
+            d_entries[entry[0]] = entry
+    l_entries = list(d_entries.values())
+
+    l_volumes = [[]]
+    dataSize = 0
+    for entry in l_entries:
+        i_offset = dataSize + (16 - dataSize % 16) % 16
+        if i_offset + entry[5] > 0xFFFFFFFF and len(l_volumes[-1]) > 0:
+            l_volumes.append([])
+            i_offset = 0
+        l_volumes[-1].append((entry, i_offset))
+        dataSize = i_offset + entry[5]
+
+    i_volume = 0
+    s_volume_name = fileName
+    while os.path.isfile(s_volume_name):
+        # Clear out volumes left by a larger earlier pack
+        os.remove(s_volume_name)
+        i_volume += 1
+        s_volume_name = f"{fileName[:-5]}_{i_volume}.pack"
 
+    for i_volume, l_volume in enumerate(l_volumes):
+        s_volume_name = fileName if i_volume == 0 else f"{fileName[:-5]}_{i_volume}.pack"
+        dataSize = l_volume[-1][1] + l_volume[-1][0][5] if len(l_volume) > 0 else 0
+        b_names = json.dumps([[entry[0], entry[1], entry[2]] for entry, _ in l_volume], separators=(',', ':')).encode()
+        b_header = bytearray()
+        b_header += b"BKHD" + struct.pack("<III", 8, WemPack.VERSION, i_volume)
+        b_header += b"DIDX" + struct.pack("<I", len(l_volume) * 12)
+        for i_id, (entry, i_offset) in enumerate(l_volume):
+            b_header += struct.pack("<III", i_id, i_offset, entry[5])
+        b_header += b"DATA" + struct.pack("<I", dataSize)
+
+        with o_run_stats.phase("pack", bytes_read=sum(entry[5] for entry, _ in l_volume), bytes_written=len(b_header) + dataSize + len(b_names), files=len(l_volume)), open(s_volume_name + ".tmp", 'wb', buffering=0) as f:
+            f.write(b_header)
+            i_written = 0
+            s_source = None
+            f_source = None
+            for entry, i_offset in l_volume:
+                if i_offset != i_written:
+                    f.write(bytes(i_offset - i_written))
+                if entry[3] != s_source:
+                    if f_source is not None:
+                        f_source.close()
+                    s_source = entry[3]
+                    f_source = open(s_source, 'rb')
+                copy_file_range(f_source, f, entry[4], entry[5])
+                i_written = i_offset + entry[5]
+            if f_source is not None:
+                f_source.close()
+            f.write(b"PKNM" + struct.pack("<I", len(b_names)) + b_names)
+        os.replace(s_volume_name + ".tmp", s_volume_name)
+
+def get_cache_file(directory, name):
+    """Path of a cache file kept alongside the game files in directory."""
+    return os.path.join(directory, ".audioops_cache", name)
+
+def save_cache_file(fileName, data):
+    """Atomically write a json cache file. Caches are optional so failing to write one (e.g. a read only folder) is ignored."""
+    try:
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        with open(fileName + ".tmp", 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(fileName + ".tmp", fileName)
+    except OSError:
+        pass
+
+class WemBankIndex:
+    """
+    Persistent index of every bnk which precaches each wem id, built from the DIDX tables alone.
+    The index is cached per bnk alongside its size and mtime so only bnks which have changed since the last run are read again.
+    """
+    VERSION = 1
+
+    def __init__(self, bnk_directory):
+        self.Directory = bnk_directory
+        self.Banks = {}
+        self.Wems = {}
+
+        s_cache_file = get_cache_file(bnk_directory, "wem_bank_index.json")
+        d_cached_banks = {}
+        if os.path.isfile(s_cache_file):
+            try:
+                with open(s_cache_file, 'r') as f:
+                    d_cache = json.load(f)
+                if d_cache.get("version") == self.VERSION:
+                    d_cached_banks = d_cache["banks"]
+            except (OSError, ValueError, KeyError):
+                d_cached_banks = {}
+
+        b_changed = False
+        for entry in sorted(os.scandir(bnk_directory), key=lambda entry: entry.name):
+            if not entry.name.endswith(".bnk") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            cached = d_cached_banks.get(entry.name)
+            if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                self.Banks[entry.name] = cached
+                continue
+            try:
+                l_didx, dataOffset = read_didx(entry.path)
+            except Exception as e:
+                # A stray or corrupt bnk shouldn't stop every other bnk being indexed, it is only an error if it has to be rebuilt
+                print(f"Warning: Skipping {entry.name} when indexing bnks as it couldn't be read ({str(e).strip()})")
+                continue
+            self.Banks[entry.name] = [stat.st_size, stat.st_mtime_ns, [[didx.WemId, dataOffset + didx.WemOffset, didx.WemSize] for didx in l_didx]]
+            b_changed = True
+        if b_changed or len(self.Banks) != len(d_cached_banks):
+            save_cache_file(s_cache_file, {"version": self.VERSION, "banks": self.Banks})
+
+        for bnk_name, cached in self.Banks.items():
+            for wemId, wemOffset, wemSize in cached[2]:
+                self.Wems.setdefault(wemId, []).append((bnk_name, wemOffset, wemSize))
+
+    def banks_containing(self, wemId):
+        """Names of the bnks precaching a wem along with its absolute offset and size in each of them."""
+        return self.Wems.get(wemId, [])
+
+
+class WemFolderIndex:
+    """
+    Index of every wem in the folder (or wem pack) being reimported, built with a single walk of it.
+    Wems are keyed by their path relative to the folder (and to their top level subfolder) without the extension, with removesuffix stripped from the name so nothing needs renaming on disk.
+    """
+    def __init__(self, wemfolder, removesuffix):
+        self.Directory = wemfolder
+        self.SubFolders = []
+        self.TopLevel = []
+        self.Root = {}
+        self.Folders = {}
+        self.HashedWems = {}
+        self.Pack = None
+        for s_relative_root, file, s_wem_path in self.walk():
+            if not file.endswith(".wem"):
+                continue
+            s_wem_name = file.replace(removesuffix, '')
+            if s_relative_root == os.curdir:
+                self.TopLevel.append(s_wem_name)
+                s_key = s_wem_name[:-4]
+                if s_key.startswith("HashedWem_") and s_key[10:].isdigit():
+                    self.HashedWems[int(s_key[10:])] = s_wem_path
+            else:
+                s_key = os.path.join(s_relative_root, s_wem_name[:-4])
+                l_key_parts = s_key.split(os.sep, 1)
+                self.Folders.setdefault(l_key_parts[0], {})[l_key_parts[1]] = s_wem_path
+            self.Root[s_key] = s_wem_path
+
+    def walk(self):
+        """Yield the folder (relative to wemfolder), file name and path of every file, or the PackedWem of every entry when wemfolder is a .pack."""
+        if os.path.isfile(self.Directory) and self.Directory.endswith(".pack"):
+            self.Pack = WemPack(self.Directory)
+            for o_wem in self.Pack.Entries:
+                s_relative_root, file = os.path.split(o_wem.RelativePath)
+                if s_relative_root == "":
+                    s_relative_root = os.curdir
+                elif s_relative_root.split(os.sep, 1)[0] not in self.SubFolders:
+                    self.SubFolders.append(s_relative_root.split(os.sep, 1)[0])
+                yield s_relative_root, file, o_wem
+            return
+        for root, dirs, files in os.walk(self.Directory, topdown=False):
+            s_relative_root = os.path.relpath(root, self.Directory)
+            if s_relative_root == os.curdir:
+                self.SubFolders = list(dirs)
+            for file in files:
+                yield s_relative_root, file, os.path.join(root, file)
+
+    def close(self):
+        if self.Pack is not None:
+            self.Pack.close()
+
+
+def file_signature(fileName):
+    """Path, size and mtime of a file, used to tell whether an input has changed between runs."""
+    if isinstance(fileName, PackedWem):
+        return fileName.signature()
+    file_stat = os.stat(fileName)
+    return [fileName, file_stat.st_size, file_stat.st_mtime_ns]
+
+class ReimportManifest:
+    """
+    Record of the inputs every wem and bnk in a reimport output folder was produced from, kept alongside them in the folder.
+    Outputs whose inputs are unchanged since the last run are kept as they are, and outputs the current run no longer produces are removed.
+    """
+    VERSION = 1
+
+    def __init__(self, output, ignore_previous = False):
+        self.Directory = output
+        self.FileName = os.path.join(output, "ReimportManifest.json")
+        self.Previous = {}
+        self.Current = {}
+        if not ignore_previous and os.path.isfile(self.FileName):
+            try:
+                with open(self.FileName, 'r') as f:
+                    d_manifest = json.load(f)
+                if d_manifest.get("version") == self.VERSION:
+                    self.Previous = d_manifest["outputs"]
+            except (OSError, ValueError, KeyError):
+                self.Previous = {}
+
+    def output_signature(self, output_name):
+        try:
+            output_stat = os.stat(os.path.join(self.Directory, output_name))
+        except OSError:
+            return None
+        return [output_stat.st_size, output_stat.st_mtime_ns]
+
+    def inputs(self, s_source, d_replaced_wems = None):
+        l_inputs = [file_signature(s_source)]
+        if d_replaced_wems is not None:
+            l_inputs += [[wem_hash] + file_signature(s_wem_path) for wem_hash, s_wem_path in d_replaced_wems.items()]
+        return l_inputs
+
+    def is_current(self, output_name, s_source, d_replaced_wems = None):
+        """True if the output was produced from the same inputs by this or the previous run and hasn't been modified since, in which case it is kept."""
+        l_inputs = self.inputs(s_source, d_replaced_wems)
+        if output_name in self.Current:
+            return self.Current[output_name][0] == l_inputs
+        previous = self.Previous.get(output_name)
+        if previous is None or previous[0] != l_inputs or previous[1] != self.output_signature(output_name):
+            return False
+        self.Current[output_name] = previous
+        return True
+
+    def record(self, output_name, s_source, d_replaced_wems = None):
+        self.Current[output_name] = [self.inputs(s_source, d_replaced_wems), self.output_signature(output_name)]
+
+    def copy(self, s_source, output_name):
+        """Copy a wem into the output folder unless it is already there from the same source."""
+        if not self.is_current(output_name, s_source):
+            with o_run_stats.phase("copy", files=1):
+                if isinstance(s_source, PackedWem):
+                    s_source.copy_to(os.path.join(self.Directory, output_name))
+                else:
+                    shutil.copy(s_source, os.path.join(self.Directory, output_name))
+            if o_run_stats.Enabled:
+                i_size = s_source.Size if isinstance(s_source, PackedWem) else os.path.getsize(s_source)
+                o_run_stats.add("copy", bytes_read=i_size, bytes_written=i_size)
+            self.record(output_name, s_source)
+
+    def replaced_wems(self, output_name):
+        """Ids of the wems the previous run replaced in a bnk it rebuilt, or None if the manifest has no record of it."""
+        previous = self.Previous.get(output_name)
+        if previous is None:
+            return None
+        return [l_input[0] for l_input in previous[0][1:]]
+
+    def remove_stale(self):
+        """Delete outputs of the previous run which this run didn't produce, as long as they haven't been modified since."""
+        for output_name, previous in self.Previous.items():
+            if output_name not in self.Current and previous[1] == self.output_signature(output_name):
+                print(f"Removing {output_name} as it is no longer produced by the reimport")
+                os.remove(os.path.join(self.Directory, output_name))
+
+    def save(self):
+        save_cache_file(self.FileName, {"version": self.VERSION, "outputs": self.Current})
+
+    def next_run(self):
+        """Start recording another run into the same output, with the run just saved as the previous one."""
+        self.Previous = self.Current
+        self.Current = {}
+
+
+class WemCatalog:
+    """
+    Sqlite database of every wem extract-wems named, indexed by hash, name, bnk and character. ExportedWems.csv is exported from it.
+    reimport-wems can resolve names to hashes from it instead of parsing the bnk xmls.
+    """
+    VERSION = 2
+    l_csv_header = ["Id", "Bnk File", "Relative Path", "Export Path", "Character", "Locres Subtitle"]
+
+    def __init__(self, fileName, create = False):
+        self.FileName = fileName
+        if create:
+            if os.path.exists(fileName):
+                os.remove(fileName)
+        elif not os.path.isfile(fileName):
+            raise Exception(f"Could not find a catalog at {fileName}")
+        # Only read from reimport-wems' worker threads, which sqlite serialises itself
+        self._db = sqlite3.connect(fileName, check_same_thread=not create)
+        if create:
+            self._db.executescript("""
+                CREATE TABLE wems (
+                    row INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    bnk TEXT NOT NULL,
+                    relative_path TEXT NOT NULL,
+                    export_path TEXT NOT NULL,
+                    character TEXT NOT NULL,
+                    subtitle TEXT NOT NULL,
+                    hash INTEGER NOT NULL,
+                    named INTEGER NOT NULL
+                );
+                CREATE TABLE banks (
+                    bnk TEXT PRIMARY KEY,
+                    xml_size INTEGER NOT NULL,
+                    xml_md5 TEXT NOT NULL
+                );
+            """)
+            self._db.execute(f"PRAGMA user_version = {self.VERSION}")
+        elif self._db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            raise Exception(f"{fileName} was written by a different version of this script, please extract again with --catalog")
+
+    def close(self):
+        self._db.close()
+
+    def add_bank(self, bnk_name, xml_size, xml_md5, l_rows):
+        """
+        Add the rows extract_bnk returned for a bnk, which are the csv columns followed by the wem's hash and whether its name came from the xml.
+        The size and md5 of the bnk's xml are kept so reimport-wems can tell whether the names still apply.
+        """
+        self._db.execute("INSERT OR REPLACE INTO banks VALUES (?, ?, ?)", (bnk_name, xml_size, xml_md5))
+        self._db.executemany("INSERT INTO wems (name, bnk, relative_path, export_path, character, subtitle, hash, named) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", l_rows)
+
+    def finish(self):
+        """Index the rows once they have all been added, which is much quicker than maintaining the indexes while inserting."""
+        self._db.executescript("""
+            CREATE INDEX IF NOT EXISTS wems_hash ON wems (hash);
+            CREATE INDEX IF NOT EXISTS wems_name ON wems (name);
+            CREATE INDEX IF NOT EXISTS wems_bnk ON wems (bnk);
+            CREATE INDEX IF NOT EXISTS wems_character ON wems (character);
+        """)
+        self._db.commit()
+
+    def export_csv(self, fileName):
+        with open(fileName, 'w', encoding='UTF8', newline='') as csvFile:
+            csvWriter = csv.writer(csvFile)
+            csvWriter.writerow(self.l_csv_header)
+            csvWriter.writerows(self._db.execute("SELECT name, bnk, relative_path, export_path, character, subtitle FROM wems ORDER BY row"))
+
+    def has_bank(self, bnk_name, xml_fileName):
+        """
+        True if the bnk was catalogued from an xml identical to xml_fileName, otherwise its names can't be trusted to match.
+        The sizes are compared first, the xml is only hashed (through the HashCache of its folder) when they match, as a patch changing ids usually keeps the size the same.
+        """
+        row = self._db.execute("SELECT xml_size, xml_md5 FROM banks WHERE bnk = ?", (bnk_name,)).fetchone()
+        if row is None or not os.path.isfile(xml_fileName) or row[0] != os.path.getsize(xml_fileName):
+            return False
+        return row[1] == get_hash_cache(os.path.dirname(xml_fileName)).md5(os.path.basename(xml_fileName))
+
+    def name_pairs(self, bnk_name):
+        """The bnk's names mapped to their hashes, in the shape BnkXmlObject.create_hash_pairs(..., False) returns, without the events."""
+        return {name: [str(wem_hash), []] for name, wem_hash in self._db.execute("SELECT name, hash FROM wems WHERE bnk = ? AND named = 1 ORDER BY row", (bnk_name,))}
+
+    def find_hash(self, wem_hash):
+        return self._db.execute("SELECT name, bnk, relative_path FROM wems WHERE hash = ? ORDER BY row", (wem_hash,)).fetchall()
+
+    def find_name(self, name):
+        return self._db.execute("SELECT hash, bnk, relative_path FROM wems WHERE name = ? ORDER BY row", (name,)).fetchall()
+
+    def character_lines(self, character):
+        return self._db.execute("SELECT name, bnk, relative_path, subtitle FROM wems WHERE character = ? ORDER BY row", (character,)).fetchall()
+
+    def relative_paths(self):
+        return [row[0] for row in self._db.execute("SELECT relative_path FROM wems ORDER BY row")]
+
+class NullStats:
+    """Stand in for RunStats when profiling is disabled, every call does nothing."""
+    Enabled = False
+
+    def phase(self, name, bytes_read = 0, bytes_written = 0, files = 0):
+        return null_context
+
+    def bank(self, bnk_name):
+        return null_context
+
+    def add(self, name, seconds = 0.0, bytes_read = 0, bytes_written = 0, files = 0, calls = 0, inclusive_seconds = None):
+        pass
+
+null_context = nullcontext()
+
+class RunStats:
+    """
+    Wall time, bytes read/written and file counts of a run, totalled per phase and per bnk for --profile and --stats-json.
+    Phases are attributed to the bnk set by the enclosing bank() context of the current thread.
+    Phases can be nested (e.g. md5 within hash_pairs), so each phase's seconds exclude the time spent in the phases nested within it, which is only counted in its inclusive_seconds.
+    """
+    Enabled = True
+
+    def __init__(self):
+        self.Phases = {}
+        self.Banks = {}
+        self.StartTime = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def counters(self, d_phases, name):
+        if name not in d_phases:
+            d_phases[name] = {"seconds": 0.0, "inclusive_seconds": 0.0, "calls": 0, "files": 0, "bytes_read": 0, "bytes_written": 0}
+        return d_phases[name]
+
+    def add(self, name, seconds = 0.0, bytes_read = 0, bytes_written = 0, files = 0, calls = 0, inclusive_seconds = None):
+        if inclusive_seconds is None:
+            inclusive_seconds = seconds
+        bnk_name = getattr(self._local, "bank", None)
+        with self._lock:
+            l_counters = [self.counters(self.Phases, name)]
+            if bnk_name is not None:
+                l_counters.append(self.counters(self.Banks[bnk_name]["phases"], name))
+            for d_counters in l_counters:
+                d_counters["seconds"] += seconds
+                d_counters["inclusive_seconds"] += inclusive_seconds
+                d_counters["calls"] += calls
+                d_counters["files"] += files
+                d_counters["bytes_read"] += bytes_read
+                d_counters["bytes_written"] += bytes_written
+
+    @contextmanager
+    def phase(self, name, bytes_read = 0, bytes_written = 0, files = 0):
+        l_nested = getattr(self._local, "nested", None)
+        if l_nested is None:
+            l_nested = self._local.nested = []
+        # Time spent in phases nested within this one, taken off its own
+        l_nested.append(0.0)
+        f_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            f_seconds = time.perf_counter() - f_start
+            f_nested_seconds = l_nested.pop()
+            if len(l_nested) > 0:
+                l_nested[-1] += f_seconds
+            self.add(name, f_seconds - f_nested_seconds, bytes_read, bytes_written, files, 1, f_seconds)
+
+    @contextmanager
+    def bank(self, bnk_name):
+        with self._lock:
+            d_bank = self.Banks.setdefault(bnk_name, {"seconds": 0.0, "phases": {}})
+        self._local.bank = bnk_name
+        f_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.bank = None
+            with self._lock:
+                d_bank["seconds"] += time.perf_counter() - f_start
+
+    def pop(self):
+        """Hand the collected stats back (e.g. from a worker process) and start afresh."""
+        with self._lock:
+            d_stats = {"phases": self.Phases, "banks": self.Banks}
+            self.Phases = {}
+            self.Banks = {}
+        return d_stats
+
+    def merge(self, d_stats):
+        with self._lock:
+            for name, d_counters in d_stats["phases"].items():
+                for key, value in d_counters.items():
+                    self.counters(self.Phases, name)[key] += value
+            for bnk_name, d_bank in d_stats["banks"].items():
+                d_own_bank = self.Banks.setdefault(bnk_name, {"seconds": 0.0, "phases": {}})
+                d_own_bank["seconds"] += d_bank["seconds"]
+                for name, d_counters in d_bank["phases"].items():
+                    for key, value in d_counters.items():
+                        self.counters(d_own_bank["phases"], name)[key] += value
+
+    def report(self, command):
+        return {
+            "command": command,
+            "total_seconds": time.perf_counter() - self.StartTime,
+            "phases": dict(sorted(self.Phases.items(), key=lambda item: -item[1]["seconds"])),
+            "slowest_banks": [[bnk_name, d_bank["seconds"]] for bnk_name, d_bank in sorted(self.Banks.items(), key=lambda item: -item[1]["seconds"])[:10]],
+            "peak_memory": peak_memory(),
+            "banks": self.Banks,
+        }
+
+    def print_summary(self, command):
+        d_report = self.report(command)
+        print(f"\nProfile of {command} ({d_report['total_seconds']:.2f}s wall time, phase times are summed across workers and Seconds leaves out the phases nested within each one):")
+        print(f"  {'Phase':<20}{'Seconds':>10}{'Inclusive':>11}{'Calls':>9}{'Files':>9}{'Read MB':>10}{'Written MB':>12}")
+        for name, d_counters in d_report["phases"].items():
+            print(f"  {name:<20}{d_counters['seconds']:>10.3f}{d_counters['inclusive_seconds']:>11.3f}{d_counters['calls']:>9}{d_counters['files']:>9}{d_counters['bytes_read'] / 1e6:>10.1f}{d_counters['bytes_written'] / 1e6:>12.1f}")
+        if d_report["peak_memory"] is not None:
+            print(f"Peak memory: {d_report['peak_memory']['main'] / 1e6:.1f} MB, {d_report['peak_memory']['largest_worker'] / 1e6:.1f} MB for the largest worker process")
+        if len(d_report["slowest_banks"]) > 0:
+            print("Slowest bnks:")
+            for bnk_name, seconds in d_report["slowest_banks"]:
+                print(f"  {bnk_name:<40}{seconds:>10.3f}s")
+
+o_run_stats = NullStats()
+
+def peak_memory():
+    """Peak resident memory in bytes of this process and of the largest of its finished worker processes, or None where the platform can't tell."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and KiB everywhere else
+    i_scale = 1 if sys.platform == "darwin" else 1024
+    return {"main": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * i_scale, "largest_worker": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * i_scale}
+
+def start_run_stats(profile, stats_json):
+    global o_run_stats
+    o_run_stats = RunStats() if profile or stats_json is not None else NullStats()
+
+def finish_run_stats(profile, stats_json, command):
+    if profile:
+        o_run_stats.print_summary(command)
+    if stats_json is not None:
+        with open(stats_json, 'w') as f:
+            json.dump(o_run_stats.report(command), f, indent=2)
 
 def md5(fname):
     hash_md5 = hashlib.md5()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
+    b_buffer = bytearray(i_buffer_size)
+    view = memoryview(b_buffer)
+    with open(fname, "rb", buffering=0) as f:
+        for i_read in iter(lambda: f.readinto(b_buffer), 0):
+            hash_md5.update(view[:i_read])
     return hash_md5.hexdigest()
 
+class HashCache:
+    """
+    Persistent cache of wem md5s keyed by file name, size and mtime so unchanged game files are only ever hashed once.
+    Entries are evicted as soon as their file is found to have changed or been removed.
+    """
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.Directory = directory
+        self.FileName = get_cache_file(directory, "md5_cache.json")
+        self.Entries = {}
+        self.NewEntries = {}
+        if os.path.isfile(self.FileName):
+            try:
+                with open(self.FileName, 'r') as f:
+                    d_cache = json.load(f)
+                if d_cache.get("version") == self.VERSION:
+                    self.Entries = d_cache["entries"]
+            except (OSError, ValueError, KeyError):
+                self.Entries = {}
+
+    def md5(self, wem_name, wem_stat = None):
+        """md5 of a file in the cache's directory, only reading the file if it has changed since it was last hashed."""
+        s_wem_path = os.path.join(self.Directory, wem_name)
+        if wem_stat is None:
+            try:
+                wem_stat = os.stat(s_wem_path)
+            except OSError:
+                self.evict(wem_name)
+                raise
+        cached = self.Entries.get(wem_name)
+        if cached is not None and cached[0] == wem_stat.st_size and cached[1] == wem_stat.st_mtime_ns:
+            return cached[2]
+        with o_run_stats.phase("md5", bytes_read=wem_stat.st_size, files=1):
+            s_hash = md5(s_wem_path)
+        self.Entries[wem_name] = self.NewEntries[wem_name] = [wem_stat.st_size, wem_stat.st_mtime_ns, s_hash]
+        return s_hash
+
+    def evict(self, wem_name):
+        if wem_name in self.Entries:
+            del self.Entries[wem_name]
+            self.NewEntries[wem_name] = None
+
+    def pop_new_entries(self):
+        """Entries added or evicted since the last call, so worker processes can hand their hashes back to be saved."""
+        d_new_entries = self.NewEntries
+        self.NewEntries = {}
+        return d_new_entries
+
+    def update(self, d_new_entries):
+        for wem_name, entry in d_new_entries.items():
+            if entry is None:
+                self.evict(wem_name)
+            else:
+                self.Entries[wem_name] = self.NewEntries[wem_name] = entry
+
+    def save(self):
+        if len(self.NewEntries) == 0:
+            return
+        save_cache_file(self.FileName, {"version": self.VERSION, "entries": self.Entries})
+        self.NewEntries = {}
+
+d_hash_caches = {}
+
+def get_hash_cache(directory):
+    """Shared HashCache for a directory, loaded the first time it is needed."""
+    s_key = os.path.abspath(directory)
+    if s_key not in d_hash_caches:
+        d_hash_caches[s_key] = HashCache(directory)
+    return d_hash_caches[s_key]
+
+s_link_fallbacks = set()
+
+def link_file(src, dst, link_mode = "copy"):
+    """Place src at dst as a copy, hardlink, reflink or symlink. Links which the filesystem can't make fall back to a copy."""
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst) and link_mode != "copy":
+            return
+        # Never write through an existing link, that would modify the file it points at
+        os.remove(dst)
+    with o_run_stats.phase("copy", files=1):
+        try:
+            if link_mode == "hardlink":
+                os.link(src, dst)
+                return
+            elif link_mode == "symlink":
+                os.symlink(os.path.abspath(src), dst)
+                return
+            elif link_mode == "reflink":
+                import fcntl
+                with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+                    fcntl.ioctl(f_dst.fileno(), 0x40049409, f_src.fileno()) # FICLONE
+                return
+        except (OSError, ImportError) as e:
+            if link_mode not in s_link_fallbacks:
+                s_link_fallbacks.add(link_mode)
+                print(f"Warning: Could not {link_mode} {src} ({e}), copying files instead")
+        shutil.copy(src, dst)
+        if o_run_stats.Enabled:
+            o_run_stats.add("copy", bytes_read=os.path.getsize(dst), bytes_written=os.path.getsize(dst))
+
+def store_wem(o_record, output, wem_paste_name, link_mode = "copy", s_digest = None):
+    """
+    Write a record's wem to a content addressed store in output and link wem_paste_name to it, so identical payloads are only ever written once.
+    The payload is hashed and copied a buffer at a time, so it is never held in memory whole. s_digest is its md5 if already known.
+    """
+    if s_digest is None:
+        s_digest = o_record.md5()
+    s_store_path = os.path.join(output, ".wem_store", s_digest[:2], s_digest + ".wem")
+    if not os.path.exists(s_store_path):
+        os.makedirs(os.path.dirname(s_store_path), exist_ok=True)
+        s_temp_path = f"{s_store_path}.{os.getpid()}.tmp"
+        with o_run_stats.phase("write", bytes_read=o_record.Size, bytes_written=o_record.Size, files=1):
+            o_record.copy_to(s_temp_path)
+        os.replace(s_temp_path, s_store_path)
+    link_file(s_store_path, wem_paste_name, "hardlink" if link_mode == "copy" else link_mode)
+
 def extract_file_names(path, ext = None):
     """Lazy function to stop me repeating the same ugly code"""
     if ext == None:
@@ -182,6 +1174,176 @@ def extract_file_names(path, ext = None):
     else:
         return [file for file in os.listdir(path) if os.path.isfile(os.path.join(path, file)) and file.split(".")[1] == ext]         
 
+class PreviousExtraction:
+    """
+    An earlier extract-wems output folder which a delta extraction only writes the differences from. Wems are compared by size and md5
+    against the ExportedWems.hashes.json every extraction records, so a delta or pack output can itself be compared against.
+    Folders extracted before it was recorded fall back to comparing with the file at the same relative path, hashed the same way as the input's.
+    """
+    HASHES_NAME = "ExportedWems.hashes.json"
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.Directory = directory
+        self.Wems = None
+        self.HashCache = get_hash_cache(directory)
+        s_hashes = os.path.join(directory, self.HASHES_NAME)
+        if os.path.isfile(s_hashes):
+            with open(s_hashes, 'r') as f:
+                d_hashes = json.load(f)
+            if d_hashes.get("version") != self.VERSION:
+                raise Exception(f"{s_hashes} was written by a different version of this script, please extract {directory} again")
+            self.Wems = d_hashes["wems"]
+            self.Paths = set(self.Wems)
+            return
+        if os.path.isfile(os.path.join(directory, "ExportedWems.pack")):
+            raise Exception(f"{directory} has no {self.HASHES_NAME} to compare its pack against, please extract it again")
+        self.Paths = set()
+        s_catalog = os.path.join(directory, "ExportedWems.db")
+        s_csv = os.path.join(directory, "ExportedWems.csv")
+        if os.path.isfile(s_catalog):
+            o_catalog = WemCatalog(s_catalog)
+            self.Paths.update(o_catalog.relative_paths())
+            o_catalog.close()
+        elif os.path.isfile(s_csv):
+            with open(s_csv, 'r', encoding='UTF8', newline='') as csvFile:
+                csvReader = csv.reader(csvFile)
+                next(csvReader, None)
+                self.Paths.update(row[2] for row in csvReader)
+        else:
+            raise Exception(f"Could not find an ExportedWems.csv or ExportedWems.db in {directory}")
+        if os.path.isdir(os.path.join(directory, "UnusedWems")):
+            self.Paths.update(os.path.join("UnusedWems", wem_name) for wem_name in extract_file_names(os.path.join(directory, "UnusedWems")))
+
+    @classmethod
+    def save_hashes(cls, output, l_changes):
+        """Record the size and md5 of every wem of an extraction, including those a delta extraction carried over unchanged, so the next one can be compared against it."""
+        d_wems = {}
+        for _, wem_relative_path, size, s_hash in l_changes:
+            d_wems[wem_relative_path] = [size, s_hash]
+        s_hashes = os.path.join(output, cls.HASHES_NAME)
+        with open(s_hashes + ".tmp", 'w') as f:
+            json.dump({"version": cls.VERSION, "wems": d_wems}, f, separators=(',', ':'))
+        os.replace(s_hashes + ".tmp", s_hashes)
+
+    def previous_md5(self, wem_relative_path, previous_stat = None):
+        if self.Wems is not None:
+            return self.Wems[wem_relative_path][1]
+        return self.HashCache.md5(wem_relative_path, previous_stat)
+
+    def compare(self, wem_relative_path, size, s_hash):
+        """Returns "added", "modified" or None if the wem with this size and md5 is unchanged."""
+        if wem_relative_path not in self.Paths:
+            return "added"
+        if self.Wems is not None:
+            previous_size = self.Wems[wem_relative_path][0]
+            previous_stat = None
+        else:
+            try:
+                previous_stat = os.stat(os.path.join(self.Directory, wem_relative_path))
+            except OSError:
+                return "added"
+            previous_size = previous_stat.st_size
+        if previous_size != size or self.previous_md5(wem_relative_path, previous_stat) != s_hash:
+            return "modified"
+        return None
+
+    def report(self, output, l_changes):
+        """
+        Write ChangeReport.json to output listing the wems added, removed, modified and renamed since the previous extraction.
+        Added wems with the same content as a removed one are reported as renamed.
+        """
+        s_new_paths = set(wem_relative_path for _, wem_relative_path, _, _ in l_changes)
+        d_removed = {}
+        for wem_relative_path in sorted(self.Paths - s_new_paths):
+            try:
+                d_removed[wem_relative_path] = self.previous_md5(wem_relative_path)
+            except OSError:
+                pass
+        d_removed_by_hash = {}
+        for wem_relative_path, s_hash in d_removed.items():
+            d_removed_by_hash.setdefault(s_hash, []).append(wem_relative_path)
+
+        d_report = {"previous": self.Directory, "added": [], "removed": [], "modified": [], "renamed": []}
+        s_reported_paths = set()
+        for s_status, wem_relative_path, _, s_hash in l_changes:
+            # Identical wems sharing a name are written to the same path
+            if s_status is None or wem_relative_path in s_reported_paths:
+                continue
+            s_reported_paths.add(wem_relative_path)
+            if s_status == "added" and len(d_removed_by_hash.get(s_hash, [])) > 0:
+                s_old_path = d_removed_by_hash[s_hash].pop(0)
+                del d_removed[s_old_path]
+                d_report["renamed"].append([s_old_path, wem_relative_path])
+            else:
+                d_report[s_status].append(wem_relative_path)
+        d_report["removed"] = list(d_removed)
+        self.HashCache.save()
+        with open(os.path.join(output, "ChangeReport.json"), 'w') as f:
+            json.dump(d_report, f, indent=2)
+        print(f"{len(d_report['added'])} added, {len(d_report['removed'])} removed, {len(d_report['modified'])} modified and {len(d_report['renamed'])} renamed wems since {self.Directory}")
+
+class ExtractFilter:
+    """
+    The bnks and wems a selective extraction is limited to. Bnks are chosen by name, and by searching the raw xmls and the bnk index
+    for the wem ids, before any bnk is opened. Wems are then chosen by id and character while extracting.
+    """
+    def __init__(self, bnk_patterns = (), vo_only = False, sfx_only = False, characters = (), wem_ids = ()):
+        if vo_only and sfx_only:
+            raise Exception("Only one of --vo-only and --sfx-only can be used")
+        if sfx_only and len(characters) > 0:
+            raise Exception("--character only selects voice lines so can't be combined with --sfx-only")
+        self.BnkPatterns = list(bnk_patterns)
+        self.VoOnly = vo_only or len(characters) > 0
+        self.SfxOnly = sfx_only
+        self.Characters = set(character.lower() for character in characters)
+        self.WemIds = set(wem_ids)
+
+    def active(self):
+        return len(self.BnkPatterns) > 0 or self.VoOnly or self.SfxOnly or len(self.WemIds) > 0
+
+    def wants_unused(self):
+        """
+        True if wems no bnk references can be selected, which is only when selecting by wem id alone. Every xml mentioning the ids is then extracted,
+        so the wanted loose wems none of them used are unused the same as in a full extraction.
+        """
+        return len(self.WemIds) > 0 and len(self.BnkPatterns) == 0 and not self.VoOnly and not self.SfxOnly
+
+    def wants_unused_wem(self, wem_short_name):
+        return self.wants_unused() and loose_wem_id(wem_short_name) in self.WemIds
+
+    def wants_bank(self, bnk_name):
+        b_vo_bnk = bnk_name.startswith("vo_") or bnk_name.startswith("VO")
+        if (self.VoOnly and not b_vo_bnk) or (self.SfxOnly and b_vo_bnk):
+            return False
+        return len(self.BnkPatterns) == 0 or any(fnmatch.fnmatch(bnk_name, pattern) for pattern in self.BnkPatterns)
+
+    def wants_wem(self, wem_id, character_name = None):
+        if len(self.WemIds) > 0 and wem_id not in self.WemIds:
+            return False
+        return len(self.Characters) == 0 or (character_name is not None and character_name.lower() in self.Characters)
+
+    def select_xml_files(self, input, l_xml_files):
+        """The xmls of the bnks which can hold wanted wems, in their original order."""
+        l_xml_files = [xml_short_name for xml_short_name in l_xml_files if self.wants_bank(xml_short_name.split(".")[0])]
+        if len(self.WemIds) == 0:
+            return l_xml_files
+        s_bnk_names = set()
+        o_wem_index = WemBankIndex(input)
+        for wem_id in self.WemIds:
+            s_bnk_names.update(bnk_name[:-4] for bnk_name, _, _ in o_wem_index.banks_containing(wem_id))
+        l_id_patterns = [f'Id={s_quote}{wem_id}{s_quote}'.encode() for wem_id in self.WemIds for s_quote in ('"', "'")]
+        for xml_short_name in l_xml_files:
+            if xml_short_name.split(".")[0] in s_bnk_names:
+                continue
+            with open(os.path.join(input, xml_short_name), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as xml_map:
+                    if any(xml_map.find(id_pattern) != -1 for id_pattern in l_id_patterns):
+                        s_bnk_names.add(xml_short_name.split(".")[0])
+        return [xml_short_name for xml_short_name in l_xml_files if xml_short_name.split(".")[0] in s_bnk_names]
+
 d_character_pairs = {
     "A" : "Pit Droid",
     "B" : "Pit Droid",
@@ -310,226 +1472,999 @@ d_character_pairs = {
     "Zeik" : "Bedlam Raider Male 5",
     "Zna4" : "Zee",
 }
+
+class CharacterResolver:
+    """
+    Works out who speaks a VO line from its wem name: the words after its last number (less "sp"/"spj") capitalised, with the common prefixes collapsed and d_character_pairs applied.
+    Every line of a character ends in the same words, so the result is memoised on those rather than worked out per wem.
+    """
+    l_common_types = ["Cal", "Ui", "Prospector", "Bd1"]
+    s_skipped_words = frozenset(["sp", "spj"])
+
+    def __init__(self, d_pairs = d_character_pairs):
+        self.Pairs = dict(d_pairs)
+        self.CommonPrefixes = [(common_type + " ", common_type) for common_type in self.l_common_types]
+        self.Memo = {}
+
+    def character_words(self, wem_name):
+        l_words = wem_name.split("_")
+        i_start = len(l_words)
+        while i_start > 0 and not l_words[i_start - 1].isdigit():
+            i_start -= 1
+        return tuple(l_words[i_start:])
+
+    def compile(self, t_words):
+        l_character = [s_word.capitalize() for s_word in t_words if s_word not in self.s_skipped_words]
+        if len(l_character) == 0:
+            l_character = ["No Character"]
+        character_name = ' '.join(l_character).rstrip()
+        for s_prefix, common_type in self.CommonPrefixes:
+            if character_name.startswith(s_prefix):
+                character_name = common_type
+                break
+        return self.Pairs.get(character_name, character_name)
+
+    def resolve(self, wem_name):
+        t_words = self.character_words(wem_name)
+        character_name = self.Memo.get(t_words)
+        if character_name is None:
+            character_name = self.Memo[t_words] = self.compile(t_words)
+        return character_name
+
+    def resolve_many(self, l_wem_names):
+        """Characters of many wem names at once, in the same order."""
+        d_memo = self.Memo
+        l_characters = []
+        for wem_name in l_wem_names:
+            t_words = self.character_words(wem_name)
+            character_name = d_memo.get(t_words)
+            if character_name is None:
+                character_name = d_memo[t_words] = self.compile(t_words)
+            l_characters.append(character_name)
+        return l_characters
+
+o_character_resolver = CharacterResolver()
+class WemRecord:
+    """
+    A wem found while extracting: its hash, resolved name, bnk, character and subtitle, along with where its payload lives, either a loose wem or a range of a bnk.
+    Named wems whose payload isn't in the dump have no SourcePath. Fields with no value are None rather than the csv's "#N/A".
+    """
+    __slots__ = ("Hash", "Name", "Bnk", "RelativePath", "Character", "Subtitle", "Named", "Embedded", "SourcePath", "Offset", "Size")
+
+    def __init__(self, wem_hash, name, bnk_name, relative_path, character = None, subtitle = None, named = True, embedded = False, source_path = None, offset = 0, size = 0):
+        self.Hash = wem_hash
+        self.Name = name
+        self.Bnk = bnk_name
+        self.RelativePath = relative_path
+        self.Character = character
+        self.Subtitle = subtitle
+        self.Named = named
+        self.Embedded = embedded
+        self.SourcePath = source_path
+        self.Offset = offset
+        self.Size = size
+
+    def row(self, output):
+        """The record's ExportedWems.csv row, followed by its hash and whether it was named by the xml as WemCatalog stores them."""
+        return [self.Name, self.Bnk, self.RelativePath, os.path.join(output, self.RelativePath), "#N/A" if self.Character is None else self.Character, "#N/A" if self.Subtitle is None else self.Subtitle, self.Hash, 1 if self.Named else 0]
+
+    def read(self):
+        """The wem's payload as bytes."""
+        if self.SourcePath is None:
+            raise Exception(f"{self.Name} has no payload in the dump")
+        with open(self.SourcePath, 'rb') as f:
+            f.seek(self.Offset)
+            return f.read(self.Size)
+
+    def copy_to(self, fileName):
+        with open(self.SourcePath, 'rb') as f_src, open(fileName, 'wb', buffering=0) as f_dst:
+            copy_file_range(f_src, f_dst, self.Offset, self.Size)
+
+    def md5(self):
+        if self.Embedded:
+            hash_md5 = hashlib.md5()
+            with open(self.SourcePath, 'rb') as f:
+                f.seek(self.Offset)
+                i_left = self.Size
+                while i_left > 0:
+                    chunk = f.read(min(i_left, i_buffer_size))
+                    if len(chunk) == 0:
+                        break
+                    hash_md5.update(chunk)
+                    i_left -= len(chunk)
+            return hash_md5.hexdigest()
+        return get_hash_cache(os.path.dirname(self.SourcePath)).md5(os.path.basename(self.SourcePath))
+
+LOCRES_VERSION = 2
+
+def locres_wem_name(locreId):
+    """The wem name a locres id belongs to, the id without its first two words."""
+    _, _, s_rest = locreId.partition("_")
+    _, s_sep, s_rest = s_rest.partition("_")
+    return s_rest if s_sep else ""
+
+def load_locres(locres):
+    """
+    Subtitles from a game.locres exported as json (using Fmodel), keyed by the wem name they belong to.
+    The whole json is decoded first, though its objects are kept as lists of key/value pairs so only the RAP namespace's entries are turned into the index dict. The index is cached alongside the locres like the bnk xmls.
+    """
+    locres_stat = os.stat(locres)
+    s_cache_file = get_cache_file(os.path.dirname(os.path.abspath(locres)), os.path.join("locres", os.path.basename(locres) + ".json"))
+    if os.path.isfile(s_cache_file):
+        try:
+            with o_run_stats.phase("locres_cache", files=1), open(s_cache_file, 'r') as f:
+                cached = json.load(f)
+            if cached["version"] == LOCRES_VERSION and cached["size"] == locres_stat.st_size and cached["mtime_ns"] == locres_stat.st_mtime_ns:
+                return cached["subtitles"]
+        except (OSError, KeyError, TypeError, ValueError):
+            pass
+
+    with o_run_stats.phase("locres", bytes_read=locres_stat.st_size, files=1), open(locres, 'r') as locresFile:
+        l_namespaces = json.load(locresFile, object_pairs_hook=lambda l_pairs: l_pairs)
+        locresDict = {}
+        for s_namespace, l_entries in l_namespaces:
+            if s_namespace == "RAP":
+                locresDict = {locres_wem_name(locreId): subtitle for locreId, subtitle in l_entries}
+    save_cache_file(s_cache_file, {"version": LOCRES_VERSION, "size": locres_stat.st_size, "mtime_ns": locres_stat.st_mtime_ns, "subtitles": locresDict})
+    return locresDict
+
+def iter_bnk_records(input, xml_short_name, locresDict = None, o_filter = None):
+    """
+    Lazily yield a WemRecord for every wem of a single bnk, the named wems of its xml followed by those only embedded in the bnk.
+    Nothing is copied or read beyond the bnk's headers and xml, payloads are only touched through the records. Given an ExtractFilter only the wems it wants are yielded.
+    """
+    s_bnkFullName = os.path.join(input,xml_short_name.replace(".xml", ".bnk"))
+    if not os.path.isfile(s_bnkFullName):
+        return
+    bnk_name = xml_short_name.split(".")[0]
+    with o_run_stats.bank(bnk_name):
+        with o_run_stats.phase("bnk_parse", files=1):
+            o_bnk = BnkObject(s_bnkFullName)
+        o_run_stats.add("bnk_parse", bytes_read=o_bnk.HeaderSize)
+        try:
+            d_bnkOnlyWems = dict.fromkeys(o_bnk.Data)
+            o_xml_file = BnkXmlObject(os.path.join(input, xml_short_name))
+            with o_run_stats.phase("hash_pairs"):
+                d_name_pairs = o_xml_file.create_hash_pairs(input)
+            b_vo = xml_short_name.startswith("vo_") or xml_short_name.startswith("VO")
+            if b_vo:
+                with o_run_stats.phase("resolve"):
+                    l_characters = o_character_resolver.resolve_many([l_names[0] for l_names in d_name_pairs.values()])
+            else:
+                l_characters = repeat(None)
+            for name_pair, character_name in zip(d_name_pairs.items(), l_characters):
+                subtitle = None
+                if b_vo:
+                    if o_filter is not None and not o_filter.wants_wem(int(name_pair[0]), character_name):
+                        continue
+                    
+                    wem_relative_path = os.path.join(character_name, bnk_name, name_pair[1][0] + ".wem")
+
+                    if locresDict != None:
+                        subtitle = locresDict.get(name_pair[1][0])
+                        if subtitle == None:
+                            subtitle = locresDict.get(name_pair[1][1][0])
+                else:
+                    if o_filter is not None and not o_filter.wants_wem(int(name_pair[0])):
+                        continue
+                    wem_relative_path = os.path.join(bnk_name, name_pair[1][0] + ".wem")
+
+                s_wem_path = os.path.join(input, name_pair[0] + ".wem")
+                try:
+                    wem_stat = os.stat(s_wem_path)
+                except OSError:
+                    yield WemRecord(int(name_pair[0]), name_pair[1][0], bnk_name, wem_relative_path, character_name, subtitle)
+                    continue
+                if int(name_pair[0]) in d_bnkOnlyWems:
+                    del d_bnkOnlyWems[int(name_pair[0])]
+                yield WemRecord(int(name_pair[0]), name_pair[1][0], bnk_name, wem_relative_path, character_name, subtitle, source_path=s_wem_path, size=wem_stat.st_size)
+
+            for i_bnkOnlyWem in d_bnkOnlyWems:
+                if o_filter is not None and not o_filter.wants_wem(i_bnkOnlyWem):
+                    continue
+                source_didx = o_bnk.Data.source_entry(i_bnkOnlyWem)
+                wem_relative_path = os.path.join(bnk_name, "HashedWem_" + str(i_bnkOnlyWem) + ".wem")
+                yield WemRecord(i_bnkOnlyWem, "HashedWem_" + str(i_bnkOnlyWem), bnk_name, wem_relative_path, named=False, embedded=True,
+                    source_path=s_bnkFullName, offset=o_bnk.DataOffset + source_didx.WemOffset, size=source_didx.WemSize)
+        finally:
+            o_bnk.close()
+
+def unused_wem_record(input, wem_short_name):
+    """Record of a loose wem which no bnk references, extracted to the UnusedWems folder."""
+    s_wem_path = os.path.join(input, wem_short_name)
+    wem_hash = int(wem_short_name[:-4]) if wem_short_name[:-4].isdigit() else None
+    return WemRecord(wem_hash, wem_short_name[:-4], None, os.path.join("UnusedWems", wem_short_name), named=False, source_path=s_wem_path, size=os.path.getsize(s_wem_path))
+
+def loose_wem_id(wem_short_name):
+    """The id of a loose wem from its file name, or None if it isn't named after one."""
+    s_stem = wem_short_name[:-4]
+    return int(s_stem) if wem_short_name.endswith(".wem") and s_stem.isdigit() else None
+
+def iter_records(input, locres = None, o_filter = None, include_unused = True):
+    """
+    Lazily yield the WemRecord of every wem extract-wems would extract from the input folder, bnk by bnk, without writing anything.
+    locres is the path of the game.locres json for subtitles. Wems no bnk references come last, unless include_unused is False or filtering by anything but wem ids.
+    """
+    input_files = extract_file_names(input)
+    input_xml_files = [file for file in input_files if file.split(".")[-1] == "xml"]
+    locresDict = load_locres(locres) if locres is not None else None
+    if o_filter is not None:
+        input_xml_files = o_filter.select_xml_files(input, input_xml_files)
+    s_used_wems = set()
+    for xml_short_name in input_xml_files:
+        for o_record in iter_bnk_records(input, xml_short_name, locresDict, o_filter):
+            if o_record.SourcePath is not None and not o_record.Embedded:
+                s_used_wems.add(o_record.Hash)
+            yield o_record
+    if include_unused and (o_filter is None or o_filter.wants_unused()):
+        for wem_short_name in input_files:
+            if wem_short_name.split(".")[-1] == "wem" and loose_wem_id(wem_short_name) not in s_used_wems and (o_filter is None or o_filter.wants_unused_wem(wem_short_name)):
+                yield unused_wem_record(input, wem_short_name)
+
+def write_record(o_record, output, link_mode = "copy", dedup = False, o_previous = None, l_changes = None, l_pack = None):
+    """
+    Write a record's payload to its path in output the way extract-wems does, or add it to l_pack for write_pack.
+    Records without a payload are skipped, as are those unchanged since a PreviousExtraction.
+    Given l_changes the record's status since the PreviousExtraction ("added" without one), path, size and md5 are added to it.
+    """
+    if o_record.SourcePath is None:
+        return
+    s_hash = None
+    if l_changes is not None:
+        s_hash = o_record.md5()
+        s_status = o_previous.compare(o_record.RelativePath, o_record.Size, s_hash) if o_previous is not None else "added"
+        l_changes.append([s_status, o_record.RelativePath, o_record.Size, s_hash])
+        if s_status is None:
+            return
+    if l_pack is not None:
+        l_pack.append((o_record.RelativePath, o_record.Hash, o_record.Bnk, o_record.SourcePath, o_record.Offset, o_record.Size))
+        return
+    wem_paste_name = os.path.join(output, o_record.RelativePath)
+    os.makedirs(os.path.dirname(wem_paste_name), exist_ok=True)
+    if not o_record.Embedded:
+        link_file(o_record.SourcePath, wem_paste_name, link_mode)
+    elif dedup:
+        store_wem(o_record, output, wem_paste_name, link_mode, s_hash)
+    else:
+        with o_run_stats.phase("write", bytes_read=o_record.Size, bytes_written=o_record.Size, files=1):
+            o_record.copy_to(wem_paste_name)
+
+def extract_bnk(input, output, xml_short_name, locresDict, link_mode = "copy", dedup = False, o_previous = None, o_filter = None, l_pack = None):
+    """
+    Extract and rename the wems belonging to a single bnk. Returns the csv rows for the bnk, followed by each wem's hash and whether it was named by the xml,
+    an array of the ids of the loose wems from input it used and the path, size and md5 of each wem along with, given a PreviousExtraction, whether it changed since.
+    Unchanged wems aren't written.
+    Given an ExtractFilter only the wems it wants are extracted. Given l_pack nothing is written, the entries write_pack needs are added to it instead.
+    """
+    l_rows = []
+    l_used_wems = array('I')
+    l_changes = []
+    for o_record in iter_bnk_records(input, xml_short_name, locresDict, o_filter):
+        l_rows.append(o_record.row(output))
+        if o_record.SourcePath is not None and not o_record.Embedded:
+            l_used_wems.append(o_record.Hash)
+        write_record(o_record, output, link_mode, dedup, o_previous, l_changes, l_pack)
+    return l_rows, l_used_wems, l_changes
+
+class MemoryBudget:
+    """
+    How extract-wems --max-memory is shared out: the number of worker processes, how many bnks they may extract ahead of the one being written to the csv and the size of the buffer payloads are copied and hashed through.
+    Every worker holds its own copy of the locres index on top of its interpreter, bnk and xml, so fewer workers are used when the budget can't fit them all.
+    What a worker and a bnk's results cost are estimates, WORKER_BYTES is roughly a worker's peak on a full dump without the locres index and ROW_BYTES a csv row along with its pack entry.
+    """
+    WORKER_BYTES = 32 * 1024 * 1024
+    ROW_BYTES = 1024
+
+    def __init__(self, max_bytes = None, jobs = 1, worker_bytes = 0, rows_per_bank = 1):
+        self.MaxBytes = max_bytes
+        self.Jobs = jobs
+        self.BufferSize = i_buffer_size
+        self.InFlight = 2 * self.Jobs
+        if max_bytes is not None:
+            # The main process needs as much as a worker besides the csv and catalog it writes
+            i_process_cost = self.WORKER_BYTES + worker_bytes
+            self.Jobs = max(1, min(jobs, max_bytes // i_process_cost - 1))
+            i_processes = self.Jobs + 1 if self.Jobs > 1 else 1
+            self.BufferSize = max(64 * 1024, min(i_buffer_size, max_bytes // i_processes // 64)) & ~0xFFFF
+            # Results of bnks extracted ahead wait in the main process, so only as many as fit in what the processes leave are let through, keeping every worker busy
+            i_spare_bytes = max_bytes - i_processes * i_process_cost
+            self.InFlight = max(self.Jobs, min(4 * self.Jobs, i_spare_bytes // (self.ROW_BYTES * max(1, rows_per_bank))))
+
+def locres_bytes(locresDict):
+    """Roughly how much memory the locres index takes up."""
+    return sys.getsizeof(locresDict) + sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in locresDict.items())
+
+def map_in_order(executor, fn, i_in_flight, *iterables):
+    """Like executor.map, except only i_in_flight calls are submitted ahead of the result being consumed, so finished results don't pile up in memory behind a slow one."""
+    l_pending = deque()
+    for args in zip(*iterables):
+        l_pending.append(executor.submit(fn, *args))
+        if len(l_pending) >= i_in_flight:
+            yield l_pending.popleft().result()
+    while len(l_pending) > 0:
+        yield l_pending.popleft().result()
+
+def init_extract_worker(locresDict, b_collect_stats, previous, buffer_size):
+    global d_worker_locres, o_run_stats, o_worker_previous, i_buffer_size
+    d_worker_locres = locresDict
+    i_buffer_size = buffer_size
+    o_run_stats = RunStats() if b_collect_stats else NullStats()
+    o_worker_previous = PreviousExtraction(previous) if previous is not None else None
+
+def extract_bnk_worker(input, output, xml_short_name, link_mode, dedup, o_filter, b_pack):
+    l_pack = [] if b_pack else None
+    l_rows, l_used_wems, l_changes = extract_bnk(input, output, xml_short_name, d_worker_locres, link_mode, dedup, o_worker_previous, o_filter, l_pack)
+    d_previous_hashes = o_worker_previous.HashCache.pop_new_entries() if o_worker_previous is not None else {}
+    return l_rows, l_used_wems, l_changes, l_pack, get_hash_cache(input).pop_new_entries(), d_previous_hashes, o_run_stats.pop() if o_run_stats.Enabled else None
+
 @click.command()
 @click.option("-i", "--input", prompt="Enter the audio source directory.", help="The name of the audio folder containing all of the raw extracted wems, bnks, xml and json from the game.")
 @click.option("-o", "--output", prompt="Enter the output directory.", help="The name of the folder where all the named extracted audio should be placed after running the script.")
 @click.option("-l", "--locres", help="The path of the game.locres file exported as a json (using Fmodel). For voice lines this will result in the output csv containing subtitles matching each line. Leave this blank if you don't want to do this.")
-def extract_wems(input, output, locres):
+@click.option("-j", "--jobs", default=1, type=click.IntRange(min=1), help="The number of processes to extract bnks with. The output is identical to extracting with a single process.")
+@click.option("--link-mode", default="copy", type=click.Choice(["copy", "hardlink", "reflink", "symlink"]), help="How wems which already exist as files in the input folder are placed in the output. Anything other than copy falls back to copying when the filesystem doesn't support it.")
+@click.option("--dedup", is_flag=True, help="Write each distinct wem embedded in a bnk only once, to a .wem_store folder in the output, and link every extracted copy of it there.")
+@click.option("--output-format", default="files", type=click.Choice(["files", "pack"]), help="Write the wems as loose files, or all into a single indexed ExportedWems.pack in the output folder which reimport-wems can read directly. --link-mode and --dedup only apply to loose files.")
+@click.option("--catalog", is_flag=True, help="Also write an indexed ExportedWems.db catalog of the extracted wems, which the csv is exported from and reimport-wems can read instead of the xmls.")
+@click.option("--previous", help="The output folder of an earlier extraction, e.g. from before a game patch, which can itself be a --previous or pack extraction. Only wems which were added or changed since it are written, and a ChangeReport.json of the added, removed, modified and renamed wems is written to the output.")
+@click.option("--bnk", "bnk_patterns", multiple=True, help="Only extract bnks whose names (without .bnk) match this glob pattern, e.g. \"VO_*_cal\". Can be given multiple times.")
+@click.option("--vo-only", is_flag=True, help="Only extract VO bnks.")
+@click.option("--sfx-only", is_flag=True, help="Only extract SFX (non VO) bnks. Can't be combined with --character.")
+@click.option("--character", "characters", multiple=True, help="Only extract voice lines of this character, as named in the output folders e.g. \"Eno Cordova\". Can be given multiple times.")
+@click.option("--wem-id", "wem_ids", multiple=True, help="Only extract the wems with these ids, given as a comma separated list or multiple times. Loose wems with these ids which no bnk references are extracted to the UnusedWems folder, unless this is combined with the other filters.")
+@click.option("--skip-unused", is_flag=True, help="Don't copy wems which no bnk references to the UnusedWems folder. This is always skipped when any of the filters above other than --wem-id on its own are used.")
+@click.option("--max-memory", type=click.IntRange(min=32), help="Roughly how many MB of memory the extraction may use. Fewer --jobs are used when they wouldn't fit, fewer bnks are extracted ahead of the csv and wems are copied and hashed through smaller buffers. What each worker process and bnk costs is estimated, so this isn't a hard limit.")
+@click.option("--profile", is_flag=True, help="Print the time, bytes read/written and files handled by each phase of the run, along with the slowest bnks.")
+@click.option("--stats-json", help="Write the time, bytes read/written and files handled per phase and per bnk to this json file.")
+def extract_wems(input, output, locres, jobs, link_mode, dedup, output_format, catalog, previous, bnk_patterns, vo_only, sfx_only, characters, wem_ids, skip_unused, max_memory, profile, stats_json):
     """This command is designed to extract and rename all of the game's wems with readable plain text names e.g. "308125441.wem" -> "vo_eff_dodge_lrg_002_rayvis.wem"."""
+    global i_buffer_size
+    start_run_stats(profile, stats_json)
+    try:
+        s_wem_ids = set(int(wem_id) for wem_id_list in wem_ids for wem_id in wem_id_list.split(",") if wem_id.strip() != "")
+    except ValueError:
+        raise Exception(f"Wem ids must be numbers, got {', '.join(wem_ids)}")
+    o_filter = ExtractFilter(bnk_patterns, vo_only, sfx_only, characters, s_wem_ids)
+    if not o_filter.active():
+        o_filter = None
+    if previous is not None and (o_filter is not None or skip_unused):
+        raise Exception("--previous compares against a full extraction so can't be combined with filters or --skip-unused")
+    if catalog and o_filter is not None:
+        raise Exception("--catalog records every wem of each bnk for reimport-wems so can't be combined with filters")
+    l_pack = [] if output_format == "pack" else None
     input_files = extract_file_names(input)
     unused_wem_files = [file for file in input_files if file.split(".")[-1] == "wem"]
     input_xml_files = [file for file in input_files if file.split(".")[-1] == "xml"]
+    if o_filter is not None:
+        if not o_filter.wants_unused():
+            # Which loose wems no bnk uses can only be known by going through every bnk
+            skip_unused = True
+        with o_run_stats.phase("filter"):
+            input_xml_files = o_filter.select_xml_files(input, input_xml_files)
+        print(f"Extracting {len(input_xml_files)} bnks matching the filters")
 
-    locresDict = {}
-    if locres != None:
-        with open(locres, 'r') as locresFile:
-            locresJson = json.load(locresFile)
-            for locreId in locresJson["RAP"].keys():
-                locresDict["_".join(locreId.split("_", 2)[2:])] = locresJson["RAP"][locreId]
+    locresDict = load_locres(locres) if locres != None else {}
+    if max_memory is not None:
+        o_budget = MemoryBudget(max_memory * 1024 * 1024, jobs, locres_bytes(locresDict) if jobs > 1 else 0, len(unused_wem_files) // max(1, len(input_xml_files)))
+        if o_budget.Jobs != jobs:
+            print(f"Extracting with {o_budget.Jobs} {'processes' if o_budget.Jobs > 1 else 'process'} to stay within --max-memory")
+    else:
+        o_budget = MemoryBudget(None, jobs)
+    jobs = o_budget.Jobs
+    i_buffer_size = o_budget.BufferSize
 
     if not os.path.exists(output):
          os.makedirs(output)
+    o_previous = None
+    if previous is not None:
+        if os.path.abspath(previous) == os.path.abspath(output):
+            raise Exception("The previous extraction must be in a different folder to the output")
+        with o_run_stats.phase("previous"):
+            o_previous = PreviousExtraction(previous)
+    l_changes = []
+    s_used_wems = set()
+    o_catalog = WemCatalog(os.path.join(output, "ExportedWems.db"), create=True) if catalog else None
     with open(os.path.join(output, "ExportedWems.csv"), 'w', encoding='UTF8', newline='') as csvFile:
         csvWriter = csv.writer(csvFile)
-        csvWriter.writerow(["Id", "Bnk File", "Relative Path", "Export Path", "Character", "Locres Subtitle"])
-        for xml_short_name in input_xml_files:
-            s_bnkFullName = os.path.join(input,xml_short_name.replace(".xml", ".bnk"))
-            if not os.path.isfile(s_bnkFullName):
-                continue
-            o_bnk = BnkObject(s_bnkFullName)
-            d_bnkOnlyWems = copy.deepcopy(o_bnk.Data)
-            o_xml_file = BnkXmlObject(os.path.join(input, xml_short_name))
-            for name_pair in o_xml_file.create_hash_pairs(input).items():
-                if (xml_short_name.startswith("vo_") or xml_short_name.startswith("VO")):
-                    character_name = []
-                    for vo_name_substring in reversed(name_pair[1][0].split("_")):
-                        if vo_name_substring.isdigit():
-                            break
-                        elif vo_name_substring != "spj" and vo_name_substring != "sp":
-                            character_name.insert(0, vo_name_substring.capitalize())
-
-                    if len(character_name) == 0:
-                        character_name = ["No Character"]
-                    character_name = ' '.join(character_name).rstrip()
-
-                    for common_type in ["Cal", "Ui", "Prospector", "Bd1"]:
-                        if (character_name.startswith(common_type + " ")):
-                            character_name = common_type
-                    if character_name in d_character_pairs:
-                        character_name = d_character_pairs[character_name]
-                    
-                    wem_relative_path = os.path.join(character_name, xml_short_name.split(".")[0],name_pair[1][0] + ".wem")
-                    wem_paste_name = os.path.join(output, wem_relative_path)
+        csvWriter.writerow(WemCatalog.l_csv_header)
+        def add_rows(xml_short_name, l_rows):
+            if o_catalog is not None:
+                o_catalog.add_bank(xml_short_name.split(".")[0], os.path.getsize(os.path.join(input, xml_short_name)), get_hash_cache(input).md5(xml_short_name), l_rows)
+            else:
+                csvWriter.writerows(row[:6] for row in l_rows)
+        if jobs > 1:
+            # Rows are gathered back in input order so the csv matches a serial run exactly
+            with ProcessPoolExecutor(max_workers=jobs, initializer=init_extract_worker, initargs=(locresDict, o_run_stats.Enabled, previous, i_buffer_size)) as executor:
+                l_results = map_in_order(executor, extract_bnk_worker, o_budget.InFlight, repeat(input), repeat(output), input_xml_files, repeat(link_mode), repeat(dedup), repeat(o_filter), repeat(l_pack is not None))
+                for xml_short_name, (l_rows, l_used_wems, l_bnk_changes, l_bnk_pack, d_new_hashes, d_previous_hashes, d_stats) in zip(input_xml_files, l_results):
+                    add_rows(xml_short_name, l_rows)
+                    s_used_wems.update(l_used_wems)
+                    l_changes += l_bnk_changes
+                    if l_pack is not None:
+                        l_pack += l_bnk_pack
+                    get_hash_cache(input).update(d_new_hashes)
+                    if o_previous is not None:
+                        o_previous.HashCache.update(d_previous_hashes)
+                    if d_stats is not None:
+                        o_run_stats.merge(d_stats)
+        else:
+            for xml_short_name in input_xml_files:
+                l_rows, l_used_wems, l_bnk_changes = extract_bnk(input, output, xml_short_name, locresDict, link_mode, dedup, o_previous, o_filter, l_pack)
+                add_rows(xml_short_name, l_rows)
+                s_used_wems.update(l_used_wems)
+                l_changes += l_bnk_changes
+    if o_catalog is not None:
+        with o_run_stats.phase("catalog"):
+            o_catalog.finish()
+            o_catalog.export_csv(os.path.join(output, "ExportedWems.csv"))
+            o_catalog.close()
+    get_hash_cache(input).save()
+    unused_wem_files = [file for file in unused_wem_files if loose_wem_id(file) not in s_used_wems and (o_filter is None or o_filter.wants_unused_wem(file))] if not skip_unused else []
+    for wem_short_name in unused_wem_files:
+        write_record(unused_wem_record(input, wem_short_name), output, link_mode, dedup, o_previous, l_changes, l_pack)
+    if l_pack is not None:
+        write_pack(os.path.join(output, "ExportedWems.pack"), l_pack)
+    with o_run_stats.phase("hashes"):
+        PreviousExtraction.save_hashes(output, l_changes)
+    if o_previous is not None:
+        with o_run_stats.phase("previous"):
+            o_previous.report(output, l_changes)
+    get_hash_cache(input).save()
+    print("Renaming Completed")
+    finish_run_stats(profile, stats_json, "extract-wems")
 
-                    subtitle = "#N/A"
-                    if locresDict != None:
-                        if name_pair[1][0] in locresDict:
-                                subtitle = locresDict[name_pair[1][0]]
-                        if subtitle == "#N/A":
-                            if name_pair[1][1][0] in locresDict:
-                                subtitle = locresDict[name_pair[1][1][0]]
-                    csvWriter.writerow([name_pair[1][0], xml_short_name.split(".")[0], wem_relative_path, wem_paste_name, character_name, subtitle])
+class WemPayloadCache:
+    """
+    Payloads of the modified wems read while rebuilding bnks, so a wem precached by several bnks is only read from disk once.
+    Threads wanting a payload another thread is still reading wait for that read rather than starting their own.
+    The least recently used payloads are dropped once they total more than max_bytes.
+    """
+    def __init__(self, max_bytes = 256 * 1024 * 1024):
+        self.MaxBytes = max_bytes
+        self.Size = 0
+        self._payloads = OrderedDict()
+        self._reading = {}
+        self._lock = threading.Lock()
+
+    def read(self, s_wem_path, size):
+        """The first size bytes of the wem, which is as much of it as fits in the bnk."""
+        key = (s_wem_path, size)
+        with self._lock:
+            if key in self._payloads:
+                self._payloads.move_to_end(key)
+                return self._payloads[key]
+            o_reading = self._reading.get(key)
+            if o_reading is None:
+                o_reading = self._reading[key] = Future()
+                b_reader = True
+            else:
+                b_reader = False
+        if not b_reader:
+            return o_reading.result()
+        try:
+            with o_run_stats.phase("read_wems", bytes_read=size, files=1):
+                if isinstance(s_wem_path, PackedWem):
+                    payload = s_wem_path.read(size)
                 else:
-                    wem_relative_path = os.path.join(xml_short_name.split(".")[0],name_pair[1][0] + ".wem")
-                    wem_paste_name = os.path.join(output, wem_relative_path)
-                    csvWriter.writerow([name_pair[1][0], xml_short_name.split(".")[0], wem_relative_path, wem_paste_name, "#N/A", "#N/A"])
+                    with open(s_wem_path, 'rb') as f:
+                        payload = f.read(size)
+        except BaseException as e:
+            with self._lock:
+                del self._reading[key]
+            o_reading.set_exception(e)
+            raise
+        with self._lock:
+            del self._reading[key]
+            if len(payload) <= self.MaxBytes:
+                self._payloads[key] = payload
+                self.Size += len(payload)
+                while self.Size > self.MaxBytes:
+                    self.Size -= len(self._payloads.popitem(last=False)[1])
+        o_reading.set_result(payload)
+        return payload
 
+class ReimportBanks:
+    """
+    What reimporting needs to know about the game's bnks: the xmls, the name to hash pairs of each bnk and the WemBankIndex of the wems every bnk embeds.
+    The pairs are only worked out the first time a bnk is matched. watch keeps this between runs, so the bnk folder is only read once however many times the wems change.
+    """
+    def __init__(self, bnkfolder, o_catalog = None):
+        self.Directory = bnkfolder
+        self.Catalog = o_catalog
+        self.XmlFiles = extract_file_names(bnkfolder, "xml")
+        self.WemIndex = WemBankIndex(bnkfolder)
+        self._name_pairs = {}
+        self._wems = {}
+        # Created up front so worker threads share the one cache
+        get_hash_cache(bnkfolder)
 
-                if os.path.exists(os.path.join(input, name_pair[0] + ".wem")):
-                    if not os.path.exists(os.path.dirname(wem_paste_name)):
-                        os.makedirs(os.path.dirname(wem_paste_name))
+    def name_pairs(self, bnk_short_name):
+        """The names of a bnk's wems keyed by their hash, as returned by BnkXmlObject.create_hash_pairs(bnkfolder, False)."""
+        d_name_pairs = self._name_pairs.get(bnk_short_name)
+        if d_name_pairs is None:
+            s_xml_name = os.path.join(self.Directory, bnk_short_name + ".xml")
+            if self.Catalog is not None and self.Catalog.has_bank(bnk_short_name, s_xml_name):
+                d_name_pairs = self.Catalog.name_pairs(bnk_short_name)
+            else:
+                o_xml_file = BnkXmlObject(s_xml_name)
+                with o_run_stats.phase("hash_pairs"):
+                    d_name_pairs = o_xml_file.create_hash_pairs(self.Directory, False)
+            self._name_pairs[bnk_short_name] = d_name_pairs
+        return d_name_pairs
 
-                    if (name_pair[0] + ".wem" in unused_wem_files):
-                        unused_wem_files.remove(name_pair[0] + ".wem" )
+    def wems(self, bnk_short_name):
+        """Ids of the wems embedded in a bnk."""
+        s_wems = self._wems.get(bnk_short_name)
+        if s_wems is None:
+            if bnk_short_name + ".bnk" in self.WemIndex.Banks:
+                s_wems = set(wemId for wemId, _, _ in self.WemIndex.Banks[bnk_short_name + ".bnk"][2])
+            else:
+                # Left out of the index as it couldn't be read, reading it again raises why
+                s_wems = set(didx.WemId for didx in read_didx(os.path.join(self.Directory, bnk_short_name + ".bnk"))[0])
+            self._wems[bnk_short_name] = s_wems
+        return s_wems
 
-                    if int(name_pair[0]) in d_bnkOnlyWems:
-                        del d_bnkOnlyWems[int(name_pair[0])]
-                    shutil.copy(os.path.join(input, name_pair[0] + ".wem"), wem_paste_name)
+def match_reimport_bank(bnk_short_name, o_banks, o_wem_folder):
+    """
+    Match the wems in the wem folder to the names in a bnk. Returns the warnings to print, the (hash, path) of every named wem matched,
+    the names of those matched from the root of the wem folder and the wems which replace ones embedded in the bnk.
+    """
+    l_warnings = []
+    l_named_wems = []
+    s_root_wems = set()
+    d_replaced_wems = {}
+    with o_run_stats.bank(bnk_short_name):
+        s_bnk_wems = o_banks.wems(bnk_short_name)
+        d_name_pairs = o_banks.name_pairs(bnk_short_name)
 
-            for i_bnkOnlyWem in d_bnkOnlyWems:
-                wem_relative_path = os.path.join(xml_short_name.split(".")[0],"HashedWem_" + str(i_bnkOnlyWem) + ".wem")
-                wem_paste_name = os.path.join(output, wem_relative_path)
-                csvWriter.writerow(["HashedWem_" + str(i_bnkOnlyWem), xml_short_name.split(".")[0], wem_relative_path, wem_paste_name, "#N/A", "#N/A"])
-                if not os.path.exists(os.path.dirname(wem_paste_name)):
-                    os.makedirs(os.path.dirname(wem_paste_name))
-                with open(wem_paste_name, 'wb') as f: 
-                    f.write(d_bnkOnlyWems[i_bnkOnlyWem])
-    for wem_short_name in unused_wem_files:
-        wem_paste_name = os.path.join(output, "UnusedWems",wem_short_name)
+        # VO wems may sit anywhere in the wem folder, with those outside the bnk's own subfolder taking priority
+        b_vo_bnk = bnk_short_name.startswith("VO")
+        d_folder_wems = o_wem_folder.Folders.get(bnk_short_name, {})
+        s_matched_wems = set()
+        
+        for name_pair in d_name_pairs.items():
+            if b_vo_bnk and name_pair[0] in o_wem_folder.Root:
+                s_named_wem_path = o_wem_folder.Root[name_pair[0]]
+                s_root_wems.add(os.path.basename(name_pair[0]) + ".wem")
+            elif name_pair[0] in d_folder_wems:
+                s_named_wem_path = d_folder_wems[name_pair[0]]
+            else:
+                continue
+            s_matched_wems.add(name_pair[0])
 
-        if not os.path.exists(os.path.dirname(wem_paste_name)):
-            os.makedirs(os.path.dirname(wem_paste_name))
+            l_named_wems.append((name_pair[1][0], s_named_wem_path))
+            if int(name_pair[1][0]) in s_bnk_wems:
+                d_replaced_wems[int(name_pair[1][0])] = s_named_wem_path
 
-        shutil.copy(os.path.join(input, wem_short_name), wem_paste_name)
-    print("Renaming Completed")
+        for unmatched_wem, s_wem_path in d_folder_wems.items():
+            if unmatched_wem in s_matched_wems:
+                continue
+            if unmatched_wem.startswith("HashedWem_") and unmatched_wem[10:].isdigit() and int(unmatched_wem[10:]) in s_bnk_wems:
+                d_replaced_wems[int(unmatched_wem[10:])] = s_wem_path
+            elif not (b_vo_bnk and unmatched_wem in o_wem_folder.Root):
+                l_warnings.append(f"Warning: Could not find matching wem for {unmatched_wem}.wem in {bnk_short_name}.bnk")
+        if b_vo_bnk:
+            for wem_hash, s_wem_path in o_wem_folder.HashedWems.items():
+                if wem_hash in s_bnk_wems:
+                    d_replaced_wems[wem_hash] = s_wem_path
+    return l_warnings, l_named_wems, s_root_wems, d_replaced_wems
 
-@click.command()
-@click.option("-w", "--wemfolder", prompt="Enter the directory containing all of the wem files you wish hashed.", help="The name of the audio folder containing all of the wem files you wish hashed. For SFX you will need the .wems to be contained in subdirectories with names which match the name of the .bnk they came from.")
-@click.option("-b", "--bnkfolder", prompt="Enter the directory containing the extracted base game .bnks and their matching xml and json files.", help="The name of the audio folder containing the extracted base game .bnks and their matching xml and json files.")
-@click.option("-o", "--output", prompt="Enter the output directory", help="The name of the folder where all the rehashed wems should be placed after running the script.")
-@click.option("-rs", "--removesuffix", help="Remove suffix of generated wem files when importing. E.G \"vo_cin_011000_cor_ninthsister_85652_cal_3F75BDB9.wem\" becomes \"vo_cin_011000_cor_ninthsister_85652_cal.wem\"")
-def reimport_wems(wemfolder, bnkfolder, output, removesuffix):
-    """This command is designed to take modified .wem files and rename them from the plain text representations to the hashes the game uses e.g. "vo_eff_dodge_lrg_002_rayvis.wem" =>  "308125441.wem". This will also modify .bnks to modify precache .wems."""
-    unmatched_wem_files = extract_file_names(wemfolder, "wem")
-    xml_files = extract_file_names(bnkfolder, "xml")
+def rebuild_reimport_bank(bnk_name, d_replaced_wems, bnkfolder, output, o_payloads):
+    s_output_name = os.path.join(output, bnk_name)
+    with o_run_stats.bank(bnk_name[:-4]):
+        with o_run_stats.phase("bnk_parse", files=1):
+            o_bnk = BnkObject(os.path.join(bnkfolder, bnk_name))
+        # Closed even if a wem can't be read or the build fails, so the bnk isn't left mapped
+        with o_bnk:
+            o_run_stats.add("bnk_parse", bytes_read=o_bnk.HeaderSize)
+            for wem_hash, s_wem_path in d_replaced_wems.items():
+                o_bnk.Data[wem_hash] = o_payloads.read(s_wem_path, o_bnk.Data.size(wem_hash))
+            with o_run_stats.phase("build", files=1):
+                o_bnk.build(s_output_name)
+        if o_run_stats.Enabled:
+            o_run_stats.add("build", bytes_written=os.path.getsize(s_output_name))
 
-    l_bnks_todo = []
-    for bnk_short_name in next(os.walk(wemfolder))[1]:
-        l_bnks_todo.append(bnk_short_name)
-    for xml_short_name in xml_files:
-        if xml_short_name.startswith("VO") and xml_short_name[:-4] not in l_bnks_todo:
-            l_bnks_todo.append(xml_short_name[:-4])
-    
-    l_completed_bnks = []
-    if not os.path.exists(output):
-         os.makedirs(output)
+def rebuild_reimport_banks(l_rebuilds, map_jobs, bnkfolder, output, o_manifest, o_payloads):
+    """Rebuild each (bnk name, replaced wems) with the given map, recording them in the manifest in order once built."""
+    l_bnk_names = [bnk_name for bnk_name, _ in l_rebuilds]
+    l_replaced_wems = [d_replaced_wems for _, d_replaced_wems in l_rebuilds]
+    for _ in map_jobs(rebuild_reimport_bank, l_bnk_names, l_replaced_wems, repeat(bnkfolder), repeat(output), repeat(o_payloads)):
+        pass
+    for bnk_name, d_replaced_wems in l_rebuilds:
+        o_manifest.record(bnk_name, os.path.join(bnkfolder, bnk_name), d_replaced_wems)
 
-    d_Updated_Wems = {}
-    
+def reimport_suffix(removesuffix):
+    """The suffix to strip from wem names given --removesuffix, defaulting to the one the extracted VO wems end in."""
     if removesuffix is not None:
         if not removesuffix.startswith("_"):
                 removesuffix = "_" + removesuffix
     else:
         removesuffix = "_3F75BDB9"
+    return removesuffix
 
-    for idx, wem_name in enumerate(unmatched_wem_files):
-        unmatched_wem_files[idx] = wem_name.replace(removesuffix, '')
+def reimport(o_wem_folder, o_banks, output, o_manifest, map_jobs, b_report_skipped = True):
+    """Reimport the wems of a WemFolderIndex into output, the whole of reimport-wems after its arguments are set up and what watch does whenever the wems change."""
+    bnkfolder = o_banks.Directory
+    xml_files = o_banks.XmlFiles
+
+    l_bnks_todo = list(o_wem_folder.SubFolders)
+    s_bnks_todo = set(l_bnks_todo)
+    for xml_short_name in xml_files:
+        if xml_short_name.startswith("VO") and xml_short_name[:-4] not in s_bnks_todo:
+            l_bnks_todo.append(xml_short_name[:-4])
+            s_bnks_todo.add(xml_short_name[:-4])
+    
+    l_completed_bnks = []
+    o_payloads = WemPayloadCache()
+    d_Updated_Wems = {}
+    s_matched_root_wems = set()
     
     print("\n\nCopying Wems and rebuilding BNKs:\n")
+    l_bnks_found = []
     for bnk_short_name in l_bnks_todo:
-        if bnk_short_name + ".xml" not in xml_files:
-            print(f"Warning: Could not find a BNK by the name of {bnk_short_name} in directory {bnkfolder}")
-            continue
-        else:
+        if bnk_short_name + ".xml" in xml_files:
             l_completed_bnks.append(bnk_short_name + ".xml")
+            if os.path.isfile(os.path.join(bnkfolder, bnk_short_name + ".bnk")):
+                l_bnks_found.append(bnk_short_name)
 
-        s_bnkFullName = os.path.join(bnkfolder, bnk_short_name + ".bnk")
-        if not os.path.isfile(s_bnkFullName):
+    l_rebuilds = []
+    s_bnks_found = set(l_bnks_found)
+    l_matches = map_jobs(match_reimport_bank, l_bnks_found, repeat(o_banks), repeat(o_wem_folder))
+    for bnk_short_name in l_bnks_todo:
+        if bnk_short_name not in s_bnks_found:
             print(f"Warning: Could not find a BNK by the name of {bnk_short_name} in directory {bnkfolder}")
             continue
+        l_warnings, l_named_wems, s_root_wems, d_replaced_wems = next(l_matches)
+        for s_warning in l_warnings:
+            print(s_warning)
+        s_matched_root_wems.update(s_root_wems)
+        for s_wem_hash, s_named_wem_path in l_named_wems:
+            if int(s_wem_hash) not in d_Updated_Wems:
+                d_Updated_Wems[int(s_wem_hash)] = s_named_wem_path
+            o_manifest.copy(s_named_wem_path, s_wem_hash + ".wem")
 
-        o_bnk = BnkObject(s_bnkFullName)
-        o_xml_file = BnkXmlObject(os.path.join(bnkfolder, bnk_short_name + ".xml"))
-
-        l_wem_files = {}
-        s_bnk_folder = os.path.join(wemfolder, bnk_short_name)
-        def get_wems(folder, isRoot):
-            for root, dirs, files in os.walk(folder, topdown=False):
-                for file in files:
-                    if file.endswith(".wem"):
-                        os.rename(os.path.join(root, file), os.path.join(root, file.replace(removesuffix, '')))
-                        l_wem_files[os.path.join(root, file.replace(removesuffix, ''))[len(folder)+1:-4]] = [os.path.join(root, file.replace(removesuffix, '')), isRoot]
-        s_bnk_folder = os.path.join(wemfolder, bnk_short_name)
-        if os.path.exists(s_bnk_folder):
-            get_wems(s_bnk_folder, False)
-        if bnk_short_name.startswith("VO"):
-            get_wems(wemfolder, True)
-        
-        b_BnkNeedsUpdating = False
-        for name_pair in o_xml_file.create_hash_pairs(bnkfolder, False).items():
-            if name_pair[0] in l_wem_files:
-                s_named_wem_path = l_wem_files[name_pair[0]][0]
-                if l_wem_files[name_pair[0]][1] == True:
-                    s_wem_shortname = os.path.basename(s_named_wem_path)
-                    if s_wem_shortname in unmatched_wem_files:
-                        unmatched_wem_files.remove(s_wem_shortname)
-
-                i_wem_hash = int(name_pair[1][0])
-                if i_wem_hash not in d_Updated_Wems:
-                    d_Updated_Wems[i_wem_hash] = s_named_wem_path
-
-                if i_wem_hash in o_bnk.Data:
-                    b_BnkNeedsUpdating = True
-                    with open(s_named_wem_path, 'rb') as f:
-                        o_bnk.Data[i_wem_hash] = f.read(len(o_bnk.Data[i_wem_hash]))
-                shutil.copy(s_named_wem_path, os.path.join(output, name_pair[1][0] + ".wem"))
-                del l_wem_files[name_pair[0]]
-
-        for unmatched_wem in l_wem_files:
-            b_added = False
-            if unmatched_wem.startswith("HashedWem_"):
-                wem_hash = int(unmatched_wem[10:])
-                if wem_hash in o_bnk.Data:
-                    b_BnkNeedsUpdating = True
-                    b_added = True
-                    with open(s_named_wem_path, 'rb') as f:
-                        o_bnk.Data[wem_hash] = f.read(len(o_bnk.Data[wem_hash]))
-            if not b_added:
-                if l_wem_files[unmatched_wem][1] == False:
-                    print(f"Warning: Could not find matching wem for {unmatched_wem}.wem in {bnk_short_name}.bnk")
-
-
-        if b_BnkNeedsUpdating == True:
-            print(f"Rebuilding {bnk_short_name}")
-            o_bnk.build(os.path.join(output,bnk_short_name +  ".bnk"))
-  
+        if len(d_replaced_wems) > 0:
+            if o_manifest.is_current(bnk_short_name + ".bnk", os.path.join(bnkfolder, bnk_short_name + ".bnk"), d_replaced_wems):
+                if b_report_skipped:
+                    print(f"Skipping {bnk_short_name} as it is unchanged since the last run")
+            else:
+                print(f"Rebuilding {bnk_short_name}")
+                l_rebuilds.append((bnk_short_name + ".bnk", d_replaced_wems))
+    rebuild_reimport_banks(l_rebuilds, map_jobs, bnkfolder, output, o_manifest, o_payloads)
+      
     print("\n\nChecking if other BNKs need updating.\n")
+    # The index already records which wems each bnk contains, so bnks only need opening to be rebuilt
+    d_shared_bnks = {}
+    for i_wem_hash, s_wem_path in d_Updated_Wems.items():
+        for bnk_name, _, _ in o_banks.WemIndex.banks_containing(i_wem_hash):
+            d_shared_bnks.setdefault(bnk_name, {})[i_wem_hash] = s_wem_path
+    l_rebuilds = []
     for xml_short_name in xml_files:
         bnk_short_name = xml_short_name.replace(".xml", ".bnk")
         s_bnkFullName = os.path.join(bnkfolder,bnk_short_name)
-        if not os.path.isfile(s_bnkFullName) or xml_short_name in l_completed_bnks:
+        if bnk_short_name not in d_shared_bnks or xml_short_name in l_completed_bnks:
             continue
-        o_bnk = BnkObject(s_bnkFullName)
-        
-        b_SharedWems = 0
-        for name_pair in d_Updated_Wems.items():
-            if name_pair[0] in o_bnk.Data:
-                b_SharedWems+= 1
-                with open(name_pair[1], 'rb') as f:
-                    o_bnk.Data[name_pair[0]] = f.read(len(o_bnk.Data[name_pair[0]]))
-                    #print(name_pair[1])
+        d_shared_wems = d_shared_bnks[bnk_short_name]
+        if o_manifest.is_current(bnk_short_name, s_bnkFullName, d_shared_wems):
+            if b_report_skipped:
+                print(f"Skipping {bnk_short_name} as it is unchanged since the last run")
+        else:
+            print(f"Rebuilding {bnk_short_name} as it contains precache of {len(d_shared_wems)} modified .wems")
+            l_rebuilds.append((bnk_short_name, d_shared_wems))
+    rebuild_reimport_banks(l_rebuilds, map_jobs, bnkfolder, output, o_manifest, o_payloads)
 
-        if b_SharedWems != 0:
-            print(f"Rebuilding {bnk_short_name} as it contains precache of {b_SharedWems} modified .wems")
-            o_bnk.build(os.path.join(output,bnk_short_name))
+    with o_run_stats.phase("manifest"):
+        o_manifest.remove_stale()
+        o_manifest.save()
+    get_hash_cache(bnkfolder).save()
+    for unmatched_wem in o_wem_folder.TopLevel:
+        if unmatched_wem not in s_matched_root_wems:
+            print(f"Warning: Could not find matching wem for {unmatched_wem}")
 
-    for unmatched_wem in unmatched_wem_files:
-        print(f"Warning: Could not find matching wem for {unmatched_wem}")
+@click.command()
+@click.option("-w", "--wemfolder", prompt="Enter the directory containing all of the wem files you wish hashed.", help="The name of the audio folder containing all of the wem files you wish hashed. For SFX you will need the .wems to be contained in subdirectories with names which match the name of the .bnk they came from. A .pack written by extract-wems --output-format pack can be given instead of a folder.")
+@click.option("-b", "--bnkfolder", prompt="Enter the directory containing the extracted base game .bnks and their matching xml and json files.", help="The name of the audio folder containing the extracted base game .bnks and their matching xml and json files.")
+@click.option("-o", "--output", prompt="Enter the output directory", help="The name of the folder where all the rehashed wems should be placed after running the script.")
+@click.option("-rs", "--removesuffix", help="Remove suffix of generated wem files when importing. E.G \"vo_cin_011000_cor_ninthsister_85652_cal_3F75BDB9.wem\" becomes \"vo_cin_011000_cor_ninthsister_85652_cal.wem\"")
+@click.option("-f", "--force", is_flag=True, help="Ignore the manifest left in the output folder by previous runs and recopy/rebuild everything.")
+@click.option("-j", "--jobs", default=1, type=click.IntRange(min=1), help="The number of threads to match wems and rebuild bnks with. The output is identical to reimporting with a single thread.")
+@click.option("-c", "--catalog", help="The ExportedWems.db written by extract-wems --catalog. Names are resolved to hashes from it rather than by parsing the xmls of the bnks it catalogued.")
+@click.option("--profile", is_flag=True, help="Print the time, bytes read/written and files handled by each phase of the run, along with the slowest bnks.")
+@click.option("--stats-json", help="Write the time, bytes read/written and files handled per phase and per bnk to this json file.")
+def reimport_wems(wemfolder, bnkfolder, output, removesuffix, force, jobs, catalog, profile, stats_json):
+    """This command is designed to take modified .wem files and rename them from the plain text representations to the hashes the game uses e.g. "vo_eff_dodge_lrg_002_rayvis.wem" =>  "308125441.wem". This will also modify .bnks to modify precache .wems."""
+    start_run_stats(profile, stats_json)
+    removesuffix = reimport_suffix(removesuffix)
+
+    with o_run_stats.phase("wem_scan"):
+        o_wem_folder = WemFolderIndex(wemfolder, removesuffix)
+    if not os.path.exists(output):
+         os.makedirs(output)
+    o_manifest = ReimportManifest(output, force)
+    o_catalog = WemCatalog(catalog) if catalog is not None else None
+    with o_run_stats.phase("bnk_index"):
+        o_banks = ReimportBanks(bnkfolder, o_catalog)
+    executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    def map_jobs(fn, *iterables):
+        """Map over the worker threads, or lazily in this thread without --jobs. Results always come back in order so the output is deterministic."""
+        return executor.map(fn, *iterables) if executor is not None else map(fn, *iterables)
+
+    reimport(o_wem_folder, o_banks, output, o_manifest, map_jobs)
+    if executor is not None:
+        executor.shutdown()
+    if o_catalog is not None:
+        o_catalog.close()
+    o_wem_folder.close()
 
     print("\n\nWem reimporting complete\n")
+    finish_run_stats(profile, stats_json, "reimport-wems")
+    
+def wem_folder_snapshot(wemfolder):
+    """Size and mtime of every wem in the folder (or of the wem pack), which watch compares to tell when the wems have changed."""
+    if os.path.isfile(wemfolder):
+        return {wemfolder: file_signature(wemfolder)}
+    d_snapshot = {}
+    for root, dirs, files in os.walk(wemfolder):
+        for file in files:
+            if file.endswith(".wem"):
+                s_wem_path = os.path.join(root, file)
+                try:
+                    d_snapshot[s_wem_path] = file_signature(s_wem_path)
+                except OSError:
+                    # Removed while walking, it will be missing from the next snapshot as well
+                    pass
+    return d_snapshot
+
+@click.command()
+@click.option("-w", "--wemfolder", prompt="Enter the directory containing all of the wem files you wish hashed.", help="The name of the audio folder containing all of the wem files you wish hashed, laid out as for reimport-wems. A .pack written by extract-wems --output-format pack can be given instead of a folder.")
+@click.option("-b", "--bnkfolder", prompt="Enter the directory containing the extracted base game .bnks and their matching xml and json files.", help="The name of the audio folder containing the extracted base game .bnks and their matching xml and json files. It is only read when watching starts.")
+@click.option("-o", "--output", prompt="Enter the output directory", help="The name of the folder where all the rehashed wems should be placed.")
+@click.option("-rs", "--removesuffix", help="Remove suffix of generated wem files when importing, as for reimport-wems.")
+@click.option("-j", "--jobs", default=1, type=click.IntRange(min=1), help="The number of threads to match wems and rebuild bnks with.")
+@click.option("-c", "--catalog", help="The ExportedWems.db written by extract-wems --catalog. Names are resolved to hashes from it rather than by parsing the xmls of the bnks it catalogued.")
+@click.option("--interval", default=0.25, type=click.FloatRange(min=0.01), help="How often to check the wem folder for changes, in seconds.")
+def watch(wemfolder, bnkfolder, output, removesuffix, jobs, catalog, interval):
+    """This command reimports the wem folder like reimport-wems, then keeps watching it and reimports again whenever its wems change. The bnks' names and indexes are kept in memory between reimports so only the wems which changed are copied and only the .bnks containing them rebuilt. Stop it with Ctrl+C."""
+    removesuffix = reimport_suffix(removesuffix)
+    if not os.path.exists(output):
+         os.makedirs(output)
+    o_manifest = ReimportManifest(output)
+    o_catalog = WemCatalog(catalog) if catalog is not None else None
+    print("Indexing BNKs")
+    o_banks = ReimportBanks(bnkfolder, o_catalog)
+    executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    def map_jobs(fn, *iterables):
+        return executor.map(fn, *iterables) if executor is not None else map(fn, *iterables)
+
+    d_snapshot = None
+    d_failed = None
+    d_pending = wem_folder_snapshot(wemfolder)
+    try:
+        while True:
+            # Only reimport once the folder has stayed the same for a whole interval, so wems still being written aren't picked up half finished
+            d_current = wem_folder_snapshot(wemfolder)
+            if d_current == d_pending and d_current != d_snapshot and d_current != d_failed:
+                f_start = time.perf_counter()
+                if d_snapshot is not None:
+                    i_changed = len([s_wem_path for s_wem_path in d_current.keys() | d_snapshot.keys() if d_current.get(s_wem_path) != d_snapshot.get(s_wem_path)])
+                    print(f"\n\n{i_changed} wems changed")
+                try:
+                    o_wem_folder = WemFolderIndex(wemfolder, removesuffix)
+                    try:
+                        reimport(o_wem_folder, o_banks, output, o_manifest, map_jobs, d_snapshot is None)
+                    finally:
+                        o_wem_folder.close()
+                except Exception as e:
+                    # e.g. a wem saved while it was being read or a bnk locked by the game, the changes are reimported again once the folder next changes
+                    print(f"\n\nError: Reimport failed ({str(e).strip()}), it will be retried when {wemfolder} next changes\n")
+                    d_failed = d_current
+                else:
+                    o_manifest.next_run()
+                    d_snapshot = d_current
+                    print(f"\n\nReimported in {time.perf_counter() - f_start:.2f}s, watching {wemfolder} for changes (Ctrl+C to stop)\n")
+            d_pending = d_current
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\n\nStopped watching\n")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if o_catalog is not None:
+            o_catalog.close()
+    
+
+class BnkLayout:
+    """
+    The sections of a memory mapped bnk and the (id, offset, size) entries of its DIDX, read without touching the wem payloads.
+    Unlike BnkObject nothing is worked around, anything malformed is collected in Errors.
+    """
+    def __init__(self, bnk_map):
+        self.Map = bnk_map
+        self.Sections = []
+        self.Errors = []
+        self.Didx = []
+        self.DataOffset = 0
+        self.DataSize = 0
+        pos = 0
+        while pos + 8 <= len(bnk_map):
+            secType = bnk_map[pos:pos + 4].decode("utf-8", "replace")
+            secSize, = struct.unpack_from("<I", bnk_map, pos + 4)
+            if pos + 8 + secSize > len(bnk_map):
+                self.Errors.append(f"{secType} runs {pos + 8 + secSize - len(bnk_map)} bytes past the end of the file")
+                secSize = len(bnk_map) - pos - 8
+            self.Sections.append((secType, pos + 8, secSize))
+            pos += 8 + secSize
+        if pos != len(bnk_map):
+            self.Errors.append(f"{len(bnk_map) - pos} bytes are left over after the last section")
+
+        d_sections = {}
+        for secType, offset, secSize in self.Sections:
+            d_sections.setdefault(secType, (offset, secSize))
+        if len(self.Sections) == 0 or self.Sections[0][0] != "BKHD":
+            self.Errors.append("Lacks BKHD")
+        if "DIDX" in d_sections:
+            offset, didxSize = d_sections["DIDX"]
+            if didxSize % 12 != 0:
+                self.Errors.append(f"DIDX is {didxSize} bytes, which isn't a whole number of 12 byte entries")
+            self.Didx = list(struct.iter_unpack("<III", bnk_map[offset:offset + didxSize - didxSize % 12]))
+            if "DATA" in d_sections:
+                self.DataOffset, self.DataSize = d_sections["DATA"]
+            else:
+                self.Errors.append("Has a DIDX but lacks DATA")
+        self.BKHD = bnk_map[d_sections["BKHD"][0]:sum(d_sections["BKHD"])] if "BKHD" in d_sections else b""
+        self.Trailing = [section for section in self.Sections if section[0] not in ("BKHD", "DIDX", "DATA")]
+
+    def section(self, section):
+        return self.Map[section[1]:section[1] + section[2]]
+
+    def entries_end(self):
+        return max((wemOffset + wemSize for _, wemOffset, wemSize in self.Didx), default=0)
+
+def payloads_equal(map_a, offset_a, map_b, offset_b, size, chunk_size = 1 << 20):
+    """Compare size bytes of two memory mapped files a chunk at a time, so large wems are never copied out whole."""
+    for i_chunk in range(0, size, chunk_size):
+        i_length = min(chunk_size, size - i_chunk)
+        if map_a[offset_a + i_chunk:offset_a + i_chunk + i_length] != map_b[offset_b + i_chunk:offset_b + i_chunk + i_length]:
+            return False
+    return True
+
+def map_bnk(f):
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > 0 else b""
+
+def verify_bnk(bnk_name, bnkfolder, output, l_intended_wems = None):
+    """
+    Compare a bnk rebuilt by reimport-wems to the source bnk it was built from, returning its entry in the verify report.
+    The rebuilt bnk must be well formed with 16 byte aligned wems inside its DATA, keep the source's BKHD, wem ids and trailing sections, and only have changed the wems in l_intended_wems if given.
+    """
+    d_result = {"bnk": bnk_name, "errors": [], "changed": [], "added": [], "removed": [], "unexpected": []}
+    s_source = os.path.join(bnkfolder, bnk_name)
+    if not os.path.isfile(s_source):
+        d_result["errors"].append(f"There is no {bnk_name} in {bnkfolder} to compare against")
+        return d_result
+    with o_run_stats.bank(bnk_name[:-4]), open(s_source, 'rb') as f_source, open(os.path.join(output, bnk_name), 'rb') as f_output:
+        source_map = map_bnk(f_source)
+        output_map = map_bnk(f_output)
+        try:
+            with o_run_stats.phase("bnk_parse", files=2):
+                o_source = BnkLayout(source_map)
+                o_output = BnkLayout(output_map)
+            o_run_stats.add("bnk_parse", bytes_read=max(0, len(source_map) - o_source.DataSize) + max(0, len(output_map) - o_output.DataSize))
+            l_errors = d_result["errors"]
+            l_errors += o_output.Errors
+            if len(o_source.Errors) > 0:
+                l_errors.append(f"The source bnk is malformed itself: {'; '.join(o_source.Errors)}")
+
+            with o_run_stats.phase("verify_layout"):
+                if o_output.BKHD != o_source.BKHD:
+                    l_errors.append("BKHD differs from the source")
+                l_source_trailing = [secType for secType, _, _ in o_source.Trailing]
+                l_output_trailing = [secType for secType, _, _ in o_output.Trailing]
+                if l_output_trailing != l_source_trailing:
+                    l_errors.append(f"Has the trailing sections {', '.join(l_output_trailing) or 'none'} rather than {', '.join(l_source_trailing) or 'none'}")
+                else:
+                    for source_section, output_section in zip(o_source.Trailing, o_output.Trailing):
+                        if o_source.section(source_section) != o_output.section(output_section):
+                            l_errors.append(f"{output_section[0]} differs from the source")
+
+                i_previous_end = 0
+                for wemId, wemOffset, wemSize in o_output.Didx:
+                    if wemOffset % 16 != 0:
+                        l_errors.append(f"Wem {wemId} is at offset {wemOffset} of DATA, which isn't 16 byte aligned")
+                    if wemOffset < i_previous_end:
+                        l_errors.append(f"Wem {wemId} overlaps the wem before it")
+                    if wemOffset + wemSize > o_output.DataSize:
+                        l_errors.append(f"Wem {wemId} runs {wemOffset + wemSize - o_output.DataSize} bytes past the end of DATA")
+                    i_previous_end = wemOffset + wemSize
+                # A bnk patched in place keeps any padding the source had at the end of DATA, one laid out afresh ends with its last wem
+                i_unused_data = o_output.DataSize - o_output.entries_end()
+                if i_unused_data != 0 and i_unused_data != o_source.DataSize - o_source.entries_end():
+                    l_errors.append(f"DATA is {o_output.DataSize} bytes but its wems end at {o_output.entries_end()}")
+
+                l_source_ids = [wemId for wemId, _, _ in o_source.Didx]
+                l_output_ids = [wemId for wemId, _, _ in o_output.Didx]
+                s_source_ids = set(l_source_ids)
+                s_output_ids = set(l_output_ids)
+                if len(s_output_ids) != len(l_output_ids):
+                    l_errors.append("DIDX lists the same wem more than once")
+                d_result["added"] = [wemId for wemId in l_output_ids if wemId not in s_source_ids]
+                d_result["removed"] = [wemId for wemId in l_source_ids if wemId not in s_output_ids]
+                if len(d_result["added"]) > 0 or len(d_result["removed"]) > 0:
+                    l_errors.append(f"{len(d_result['added'])} wems were added and {len(d_result['removed'])} removed")
+                elif l_output_ids != l_source_ids:
+                    l_errors.append("DIDX lists the wems in a different order to the source")
+
+            with o_run_stats.phase("verify_wems", bytes_read=o_source.DataSize + o_output.DataSize):
+                d_source_entries = {wemId: (wemOffset, wemSize) for wemId, wemOffset, wemSize in o_source.Didx}
+                s_intended_wems = set(l_intended_wems) if l_intended_wems is not None else None
+                for wemId, wemOffset, wemSize in o_output.Didx:
+                    if wemId not in d_source_entries or wemOffset + wemSize > o_output.DataSize:
+                        continue
+                    i_source_offset, i_source_size = d_source_entries[wemId]
+                    if i_source_size == wemSize and payloads_equal(source_map, o_source.DataOffset + i_source_offset, output_map, o_output.DataOffset + wemOffset, wemSize):
+                        continue
+                    s_wem_md5 = hashlib.md5(output_map[o_output.DataOffset + wemOffset:o_output.DataOffset + wemOffset + wemSize]).hexdigest()
+                    d_result["changed"].append({"id": wemId, "source_size": i_source_size, "size": wemSize, "md5": s_wem_md5})
+                    if s_intended_wems is not None and wemId not in s_intended_wems:
+                        d_result["unexpected"].append(wemId)
+                if len(d_result["unexpected"]) > 0:
+                    l_errors.append(f"{len(d_result['unexpected'])} wems changed which the reimport didn't replace")
+        finally:
+            if isinstance(source_map, mmap.mmap):
+                source_map.close()
+            if isinstance(output_map, mmap.mmap):
+                output_map.close()
+    return d_result
+
+def init_verify_worker(b_collect_stats):
+    global o_run_stats
+    o_run_stats = RunStats() if b_collect_stats else NullStats()
+
+def verify_bnk_worker(bnk_name, bnkfolder, output, l_intended_wems):
+    d_result = verify_bnk(bnk_name, bnkfolder, output, l_intended_wems)
+    return d_result, o_run_stats.pop() if o_run_stats.Enabled else None
+
+@click.command()
+@click.option("-b", "--bnkfolder", prompt="Enter the directory containing the extracted base game .bnks.", help="The name of the audio folder containing the base game .bnks the reimport was built from.")
+@click.option("-o", "--output", prompt="Enter the reimport output directory", help="The output folder of reimport-wems whose rebuilt .bnks should be checked.")
+@click.option("-j", "--jobs", default=1, type=click.IntRange(min=1), help="The number of processes to check bnks with.")
+@click.option("-r", "--report", help="The json file to write the differences between each rebuilt bnk and its source to. They are printed if this is left blank.")
+@click.option("--profile", is_flag=True, help="Print the time, bytes read/written and files handled by each phase of the run, along with the slowest bnks.")
+@click.option("--stats-json", help="Write the time, bytes read/written and files handled per phase and per bnk to this json file.")
+def verify_bnks(bnkfolder, output, jobs, report, profile, stats_json):
+    """This command checks the .bnks rebuilt by reimport-wems against the base game .bnks they were built from, without needing to load the game. Only the headers and DIDX are parsed and the wems are compared one by one, so it is quick enough to run after every reimport. It exits with an error if any bnk fails."""
+    start_run_stats(profile, stats_json)
+    l_bnk_names = extract_file_names(output, "bnk")
+    o_manifest = ReimportManifest(output)
+    l_intended = [o_manifest.replaced_wems(bnk_name) for bnk_name in l_bnk_names]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_verify_worker, initargs=(o_run_stats.Enabled,)) as executor:
+            l_results = []
+            for d_result, d_stats in executor.map(verify_bnk_worker, l_bnk_names, repeat(bnkfolder), repeat(output), l_intended):
+                l_results.append(d_result)
+                if d_stats is not None:
+                    o_run_stats.merge(d_stats)
+    else:
+        l_results = [verify_bnk(bnk_name, bnkfolder, output, l_intended_wems) for bnk_name, l_intended_wems in zip(l_bnk_names, l_intended)]
+
+    l_failed = [d_result for d_result in l_results if len(d_result["errors"]) > 0]
+    for d_result in l_failed:
+        for s_error in d_result["errors"]:
+            print(f"Error: {d_result['bnk']}: {s_error}")
+    d_report = {"version": 1, "checked": len(l_results), "failed": len(l_failed), "banks": l_results}
+    if report is not None:
+        with open(report, 'w') as f:
+            json.dump(d_report, f, indent=2)
+    else:
+        print(json.dumps(d_report, indent=2))
+    print(f"\n\nVerified {len(l_results)} bnks, {len(l_failed)} failed\n")
+    finish_run_stats(profile, stats_json, "verify-bnks")
+    if len(l_failed) > 0:
+        sys.exit(1)
     
 
 mycommands.add_command(extract_wems)
 mycommands.add_command(reimport_wems)
+mycommands.add_command(watch)
+mycommands.add_command(verify_bnks)
 if __name__ == "__main__":
     mycommands()
\ No newline at end of file
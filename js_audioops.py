@@ -0,0 +1,15 @@
+"""
+Importable name for js-audioops.py, which can't be imported directly because of the hyphen, e.g.
+
+    from js_audioops import iter_records
+    for o_record in iter_records("audio", "game.locres.json"):
+        print(o_record.Hash, o_record.Name, o_record.Character, o_record.Subtitle)
+"""
+import importlib.util
+import os
+import sys
+
+_spec = importlib.util.spec_from_file_location(__name__, os.path.join(os.path.dirname(os.path.abspath(__file__)), "js-audioops.py"))
+_module = importlib.util.module_from_spec(_spec)
+sys.modules[__name__] = _module
+_spec.loader.exec_module(_module)